@@ -0,0 +1,208 @@
+"""Inverted Annotation Index
+
+This module builds an inverted index from the lemmas (or POS tags)
+in a TokenStore to the annotations of one layer that contain them,
+and to the moralizations those annotations belong to.
+Once built, lookups only take a dictionary access and an array
+slice, and AND/OR queries over several values are set operations
+on sorted arrays; no NLP model is needed.
+
+The index is derived from the token store of the corpus (see
+token_store.py), which can be kept on disk; the index itself is
+cached on the CorpusData object, per layer, attribute and backend.
+"""
+
+
+import numpy as np
+
+import token_store as ts
+
+
+class AnnotationIndex:
+    """
+    Inverted index over the annotations of one layer of a corpus.
+
+    Attributes
+    ----------
+    attribute : str
+        'lemma' or 'pos'
+    vocab : dict
+        maps every lemma / POS tag to its row in the index
+    offsets : int64 array
+        postings of row i are postings[offsets[i]:offsets[i + 1]]
+    postings : int64 array
+        sorted annotation IDs (positions in the annotation layer)
+    moralization_ids : int64 array
+        position of the moralization containing each annotation in
+        corpus.moralizations, or -1 if it is not inside of one
+    """
+
+    def __init__(self, store, coordinates, moralization_ids,
+                 attribute='lemma'):
+        """
+        Builds the index from a TokenStore, the coordinates of all
+        annotations and the moralization ID of every annotation.
+        """
+        if attribute == 'lemma':
+            value_ids = store.lemma_ids
+            vocab = store.lemma_vocab
+        elif attribute == 'pos':
+            value_ids = store.pos_ids
+            vocab = store.pos_vocab
+        else:
+            raise ValueError(f"Unknown token attribute: {attribute}")
+
+        self.attribute = attribute
+        self.vocab = {value: i for i, value in enumerate(vocab)}
+        self.moralization_ids = np.asarray(moralization_ids, dtype=np.int64)
+
+        n_annotations = len(coordinates)
+        coordinates = np.asarray(coordinates, dtype=np.int64).reshape(-1, 2)
+
+        # Token range of every annotation, as in TokenStore.token_range()
+        first = np.searchsorted(store.starts, coordinates[:, 0], 'left')
+        last = np.searchsorted(store.ends, coordinates[:, 1], 'right')
+        counts = np.maximum(last - first, 0)
+
+        # (value, annotation) pair for every token of every annotation
+        annotation_ids = np.repeat(np.arange(n_annotations), counts)
+        token_ids = (
+            np.repeat(first, counts)
+            + np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        )
+        keys = np.unique(
+            value_ids[token_ids].astype(np.int64) * max(n_annotations, 1)
+            + annotation_ids
+        )
+
+        rows = keys // max(n_annotations, 1)
+        self.postings = keys % max(n_annotations, 1)
+        self.offsets = np.searchsorted(rows, np.arange(len(vocab) + 1))
+
+    def annotations(self, value):
+        """
+        Returns the sorted IDs of the annotations that contain
+        a token with the given lemma / POS tag.
+        """
+        row = self.vocab.get(value)
+        if row is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+    def annotations_any(self, values):
+        """
+        OR query: returns the sorted IDs of the annotations that contain
+        a token with at least one of the lemmas / POS tags.
+        """
+        ids = [self.annotations(value) for value in values]
+        if not ids:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(ids))
+
+    def annotations_all(self, values):
+        """
+        AND query: returns the sorted IDs of the annotations that contain
+        tokens with every one of the lemmas / POS tags.
+        """
+        ids = None
+        for value in values:
+            postings = self.annotations(value)
+            if ids is None:
+                ids = postings
+            else:
+                ids = np.intersect1d(ids, postings, assume_unique=True)
+        if ids is None:
+            return np.zeros(0, dtype=np.int64)
+        return ids
+
+    def moralizations(self, annotation_ids, unique=True):
+        """
+        Takes sorted annotation IDs. Returns the sorted IDs of the
+        moralizations they are inside of. If unique is False, a
+        moralization is returned once per annotation, as in the
+        annotation lists of CorpusData.associations().
+        """
+        ids = self.moralization_ids[np.asarray(annotation_ids, dtype=np.int64)]
+        ids = ids[ids >= 0]
+        if unique:
+            return np.unique(ids)
+        # A stable sort keeps the annotations of a moralization in order
+        return np.sort(ids, kind='stable')
+
+    def lookup(self, values):
+        """
+        Takes a list of lemmas / POS tags, e.g. a whole DiMi list.
+        Returns a dictionary that maps every value to the sorted IDs
+        of the moralizations with an annotation containing it.
+        """
+        return {
+            value: self.moralizations(self.annotations(value))
+            for value in values
+        }
+
+
+def annotation_index(
+        corpus,
+        label_type,
+        language,
+        attribute='lemma',
+        hanta=False,
+        cache_dir=None,
+        store=None
+):
+    """
+    Returns the AnnotationIndex of one layer of a corpus. It is built
+    from the corpus' token store the first time and then reused until
+    the text, the moralizations or the layer change.
+
+    Parameters:
+        corpus: CorpusData object
+        label_type: name of an annotation attribute, e.g. 'protagonists'
+        language: 'de', 'en', 'fr' or 'it'
+        attribute: 'lemma' or 'pos'
+        hanta: If True, the tokens are tagged with HanTa;
+               see ts.nlp_backend().
+        cache_dir: Directory for the token store, see token_store.py.
+        store: TokenStore to build the index from instead of the
+               corpus' token store, e.g. the one passed to the
+               label_filtering_single functions. Such an index
+               is not cached.
+    Returns:
+        AnnotationIndex object.
+    """
+    backend = ts.nlp_backend(hanta, language)
+
+    def build():
+        tokens = store
+        if tokens is None:
+            tokens = ts.token_store(corpus, language, backend == 'hanta',
+                                    cache_dir)
+        labels = getattr(corpus, label_type)
+        # Duplicate moralizations share the ID of their first occurrence,
+        # like the keys of CorpusData.associations()
+        positions = {}
+        for i, moralization in enumerate(corpus.moralizations):
+            positions.setdefault(moralization, i)
+
+        moralization_ids = []
+        for label in labels:
+            moralization = corpus.moralization_index.containing(
+                label["Coordinates"])
+            moralization_ids.append(positions.get(moralization, -1))
+
+        return AnnotationIndex(
+            tokens,
+            [label["Coordinates"] for label in labels],
+            moralization_ids,
+            attribute
+        )
+
+    if store is not None:
+        return build()
+
+    return corpus.cached(
+        ("annotation_index", label_type, attribute, backend, language),
+        ("text", "moralizations", label_type),
+        build
+    )
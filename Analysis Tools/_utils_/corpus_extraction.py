@@ -14,7 +14,24 @@ Author: Bruno Brocai
 """
 
 
+import hashlib
+import itertools
+import json
+import os
+import zlib
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xmi_analysis_util as xau
+
+
+SPAN_TAG = "{http:///custom.ecore}Span"
+SOFA_TAG = "{http:///uima/cas.ecore}Sofa"
+
+# Increase whenever the extracted layers change,
+# so that old cache files are no longer used
+PARSER_VERSION = 1
 
 
 class CorpusData:
@@ -30,6 +47,9 @@ class CorpusData:
         corpus string
     moralizations : list of 2-tuples
         beginnings and ends of moralizing segments
+    detailed_moralizations : list of dicts containing 2-tuples and category
+        beginnings and ends of all segments of the moralization layer
+        (including non-moralizing ones), together with their category
     obj_morals : list of dicts containing 2-tuples and annotation info
         beginnings and ends of moral value segments, together with their
         moral category according to MFT
@@ -57,10 +77,14 @@ class CorpusData:
         expl_demands + impl_demands
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, streaming=False, cache_dir=None):
         """
         Initializes all attributes with data from an xmi file
-        specified by filepath.
+        specified by filepath. If streaming is True, the file is
+        parsed incrementally, which keeps memory usage low for
+        very large files. If a cache_dir is given, the extracted
+        data is stored there and reused as long as the file
+        does not change.
         """
         self.text = ""
         self.moralizations = []
@@ -75,32 +99,190 @@ class CorpusData:
         self.impl_demands = []
         self.all_demands = []
 
-        self.load_data_from_file(filepath)
+        # Data derived from the attributes above, see cached()
+        self._cache = {}
 
-    def load_data_from_file(self, filepath):
+        self.load_data_from_file(filepath, streaming, cache_dir)
+
+    def load_data_from_file(self, filepath, streaming=False, cache_dir=None):
         """
         Assigns values to all attributes using data from an xmi file
-        specified by filepath.
+        specified by filepath. The file is only parsed once.
         """
-        self.text = text_from_xmi(filepath)
-        self.moralizations = list_moralizations_from_xmi(filepath)
-        self.detailed_moralizations = list_detailed_moralizations_from_xmi(
-            filepath
-        )
-        self.obj_morals = list_obj_moral_from_xmi(filepath)
-        self.subj_morals = list_subj_moral_from_xmi(filepath)
+        layers = load_layers(filepath, streaming, cache_dir)
+
+        self.text = layers["text"]
+        self.moralizations = layers["moralizations"]
+        self.detailed_moralizations = layers["detailed_moralizations"]
+        self.obj_morals = layers["obj_morals"]
+        self.subj_morals = layers["subj_morals"]
         self.all_morals = self.obj_morals + self.subj_morals
-        self.protagonists = list_protagonists_from_xmi(
-            filepath,
+        self.protagonists = filter_protagonists(
+            layers["protagonists_doubles"],
             skip_duplicates=True)
-        self.protagonists_doubles = list_protagonists_from_xmi(
-            filepath,
-            skip_duplicates=False)
-        self.com_functions = list_comfunction_from_xmi(filepath)
-        self.expl_demands = list_expldemand_from_xmi(filepath)
-        self.impl_demands = list_impldemand_from_xmi(filepath)
+        self.protagonists_doubles = layers["protagonists_doubles"]
+        self.com_functions = layers["com_functions"]
+        self.expl_demands = layers["expl_demands"]
+        self.impl_demands = layers["impl_demands"]
         self.all_demands = self.expl_demands + self.impl_demands
 
+    def cached(self, key, attributes, build):
+        """
+        Returns data derived from some of the attributes, computing
+        it with build() only if it is not cached yet.
+        The cached data is dropped automatically as soon as
+        one of the attributes is reassigned or changes its length.
+        Changes that keep the length of an attribute, such as editing
+        an annotation dict or replacing one annotation by another,
+        are not detected; call invalidate() after making them.
+
+        Parameters:
+            key: hashable name of the cached data
+            attributes: names of the attributes the data is based on
+            build: function without arguments that computes the data
+        Returns:
+            The (possibly cached) return value of build().
+        """
+        sources = tuple(getattr(self, name) for name in attributes)
+        lengths = tuple(len(source) for source in sources)
+
+        entry = self._cache.get(key)
+        if (entry is None
+                or entry[2] != lengths
+                or any(a is not b for a, b in zip(entry[1], sources))):
+            entry = (tuple(attributes), sources, lengths, build())
+            self._cache[key] = entry
+
+        return entry[3]
+
+    def invalidate(self, *attributes):
+        """
+        Drops all cached data that is based on one of the given
+        attributes, e.g. corpus.invalidate('protagonists') after
+        editing annotations in place. all_morals, all_demands and
+        protagonists share their annotation dicts with the layers they
+        are built from, so name those as well. Without arguments,
+        the whole cache is dropped.
+        """
+        if not attributes:
+            self._cache.clear()
+            return
+
+        for key, entry in list(self._cache.items()):
+            if set(entry[0]) & set(attributes):
+                del self._cache[key]
+
+    @property
+    def moralization_index(self):
+        """xau.SpanIndex over the moralizations of the corpus."""
+        return self.cached(
+            "moralization_index",
+            ("moralizations",),
+            lambda: xau.SpanIndex(self.moralizations)
+        )
+
+    def associations(self, label_type, coordinates_only=False):
+        """
+        Assigns the annotations of one layer to the moralizations
+        they are part of. The result is computed once per layer and
+        reused until the layer or the moralizations change.
+
+        Parameters:
+            label_type: name of an annotation attribute,
+                        e.g. 'all_morals' or 'protagonists'
+            coordinates_only: if True, the lists only contain the
+                              coordinates of the annotations, like
+                              xau.label_associations(); otherwise
+                              the annotation dicts themselves, like
+                              xau.label_associations_category().
+        Returns:
+            Dictionary with moralizations as keys and lists of
+            annotations as values.
+        """
+        if coordinates_only:
+            return self.cached(
+                ("associations", label_type, True),
+                ("moralizations", label_type),
+                lambda: {
+                    moralization: [label["Coordinates"] for label in labels]
+                    for moralization, labels
+                    in self.associations(label_type).items()
+                }
+            )
+
+        return self.cached(
+            ("associations", label_type, False),
+            ("moralizations", label_type),
+            lambda: xau.label_associations_category(
+                self.moralizations,
+                getattr(self, label_type),
+                index=self.moralization_index
+            )
+        )
+
+    def label_counts(self, label_type, key, labels):
+        """
+        Counts how often every label occurs as the value of key
+        in one annotation layer; see xau.count_labels().
+        The counts are cached until the layer changes.
+
+        Parameters:
+            label_type: name of an annotation attribute, e.g. 'all_morals'
+            key: annotation key to count, e.g. 'Category' or 'Rolle'
+            labels: list of labels that are counted
+        Returns:
+            Integer array with one count per label.
+        """
+        labels = tuple(labels)
+        return self.cached(
+            ("label_counts", label_type, key, labels),
+            (label_type,),
+            lambda: xau.count_labels(getattr(self, label_type), key, labels)
+        )
+
+    def label_pair_counts(self, label_type, key1, labels1, key2, labels2):
+        """
+        Counts how often every pair of labels occurs as the values of
+        key1 and key2 of one annotation; see xau.count_label_pairs().
+        The counts are cached until the layer changes.
+
+        Parameters:
+            label_type: name of an annotation attribute, e.g. 'protagonists'
+            key1, key2: annotation keys, e.g. 'Gruppe' and 'Rolle'
+            labels1, labels2: lists of labels that are counted
+        Returns:
+            Integer array of shape (len(labels1), len(labels2)).
+        """
+        labels1 = tuple(labels1)
+        labels2 = tuple(labels2)
+        return self.cached(
+            ("label_pair_counts", label_type, key1, labels1, key2, labels2),
+            (label_type,),
+            lambda: xau.count_label_pairs(getattr(self, label_type),
+                                          key1, labels1, key2, labels2)
+        )
+
+    def presence_matrix(self, label_type, labels):
+        """
+        Boolean matrix that shows which labels occur in the annotations
+        of every moralization; see xau.presence_matrix().
+        The matrix is cached until the layer or the moralizations change.
+
+        Parameters:
+            label_type: name of an annotation attribute, e.g. 'all_morals'
+            labels: list of labels, one per column
+        Returns:
+            Boolean array of shape (moralizations, labels).
+        """
+        labels = tuple(labels)
+        return self.cached(
+            ("presence_matrix", label_type, labels),
+            ("moralizations", label_type),
+            lambda: xau.presence_matrix(self.moralizations,
+                                        self.associations(label_type),
+                                        labels)
+        )
+
 
 class CorpusCollection:
     """
@@ -117,66 +299,399 @@ class CorpusCollection:
         CorpusData objects
     """
 
-    def __init__(self, filepath_list, language='all'):
+    def __init__(self,
+                 filepath_list,
+                 language='all',
+                 streaming=False,
+                 cache_dir=None,
+                 workers=None):
+        """
+        Creates one CorpusData object per filepath; streaming and
+        cache_dir are passed on to CorpusData. If workers is an int
+        larger than 1, the files are read by that many processes
+        in parallel.
+        """
         self.collection = {}
         self.language = language
-        for filepath in filepath_list:
-            self.collection[filepath] = CorpusData(filepath)
 
+        if workers is None or workers <= 1:
+            for filepath in filepath_list:
+                self.collection[filepath] = CorpusData(filepath,
+                                                       streaming,
+                                                       cache_dir)
+            return
+
+        # map() returns the results in input order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            corpora = executor.map(CorpusData,
+                                   filepath_list,
+                                   itertools.repeat(streaming),
+                                   itertools.repeat(cache_dir))
+            for filepath, corpus in zip(filepath_list, corpora):
+                self.collection[filepath] = corpus
+
+    def label_counts(self, label_type, key, labels):
+        """
+        Sum of CorpusData.label_counts() over all corpora.
+        Since every corpus caches its own counts, adding or removing
+        a corpus only requires counting that corpus.
+        """
+        return sum(
+            (corpus.label_counts(label_type, key, labels)
+             for corpus in self.collection.values()),
+            np.zeros(len(labels), dtype=np.int64)
+        )
 
-def text_from_xmi(filepath):
+    def label_pair_counts(self, label_type, key1, labels1, key2, labels2):
+        """
+        Sum of CorpusData.label_pair_counts() over all corpora,
+        each of which caches its own counts.
+        """
+        return sum(
+            (corpus.label_pair_counts(label_type, key1, labels1,
+                                      key2, labels2)
+             for corpus in self.collection.values()),
+            np.zeros((len(labels1), len(labels2)), dtype=np.int64)
+        )
+
+
+def load_layers(filepath, streaming=False, cache_dir=None):
     """
-    Extracts the corpus string that the annotations are based on
-    from an xmi file.
+    Returns the corpus string and all annotation layers of an xmi file,
+    as described in layers_from_xmi().
 
     Parameters:
         filepath: The xmi file you want to open.
+        streaming: If True, use stream_layers_from_xmi() for parsing.
+        cache_dir: Directory for cache files. If None, nothing is cached.
     Returns:
-        The corpus as a string
+        Dictionary of annotation layers as described in layers_from_xmi().
     """
 
-    # Open the XMI file
-    tree = ET.parse(filepath)
-    root = tree.getroot()
+    if cache_dir is None:
+        if streaming:
+            return stream_layers_from_xmi(filepath)
+        return layers_from_xmi(filepath)
 
-    text = root.find("{http:///uima/cas.ecore}Sofa").get('sofaString')
+    # Cache files are addressed by content, so a changed file
+    # or a new parser version never hits an outdated entry
+    cache_path = os.path.join(
+        cache_dir,
+        f"{file_hash(filepath)}.v{PARSER_VERSION}.layers.json.z"
+    )
 
-    return text
+    layers = read_layers_cache(cache_path)
+    if layers is None:
+        layers = load_layers(filepath, streaming)
+        write_layers_cache(cache_path, layers)
 
+    return layers
 
-def list_detailed_moralizations_from_xmi(filepath):
+
+def file_hash(filepath):
+    """Returns the SHA-1 hex digest of the content of a file."""
+
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def read_layers_cache(cache_path):
     """
-    Takes an xmi file and returns a list with 2-tuples.
-    The tuples mark the beginning and ending of spans that were
-    categorized as "moralizing speech acts".
+    Reads annotation layers written by write_layers_cache().
+    Returns None if the file does not exist, cannot be read
+    or was written by a different parser version.
+
+    The file is plain JSON, so reading a cache file planted in a
+    shared cache directory can at worst yield wrong layers, but
+    never runs code.
+    """
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        if cached["version"] != PARSER_VERSION:
+            return None
+        return restore_layers(cached["layers"])
+    except (OSError, ValueError, zlib.error,
+            KeyError, TypeError, AttributeError):
+        return None
+
+
+def write_layers_cache(cache_path, layers):
+    """
+    Stores annotation layers as compressed JSON;
+    see xau.atomic_write().
+    """
+
+    data = json.dumps({"version": PARSER_VERSION, "layers": layers},
+                      ensure_ascii=False)
+    with xau.atomic_write(cache_path) as temp_path, \
+            open(temp_path, 'wb') as f:
+        f.write(zlib.compress(data.encode('utf-8'), 1))
+
+
+def restore_layers(layers):
+    """
+    Turns the coordinates of layers read from JSON back into tuples,
+    as returned by layers_from_xmi().
+    """
+
+    restored = {"text": layers.pop("text")}
+    restored["moralizations"] = [
+        tuple(coordinates) for coordinates in layers.pop("moralizations")
+    ]
+    for key, annotations in layers.items():
+        restored[key] = [
+            dict(annotation, Coordinates=tuple(annotation["Coordinates"]))
+            for annotation in annotations
+        ]
+
+    return restored
+
+
+def layers_from_xmi(filepath):
+    """
+    Parses an xmi file a single time and extracts the corpus string
+    together with every annotation layer.
 
     Parameters:
         filepath: The xmi file you want to open.
     Returns:
-        List of 2-tuples.
+        Dictionary with the keys 'text', 'moralizations',
+        'detailed_moralizations', 'obj_morals', 'subj_morals',
+        'protagonists_doubles', 'com_functions', 'expl_demands' and
+        'impl_demands'. The values have the same format as the
+        return values of the list_*_from_xmi() functions below.
     """
 
     # Open the XMI file
     tree = ET.parse(filepath)
     root = tree.getroot()
 
-    span_list = root.findall("{http:///custom.ecore}Span")
+    layers = layers_from_spans(root.iterfind(SPAN_TAG))
+    layers["text"] = root.find(SOFA_TAG).get('sofaString')
+
+    return layers
+
+
+def stream_layers_from_xmi(filepath):
+    """
+    Works like layers_from_xmi(), but parses the xmi file incrementally.
+    Every element is discarded as soon as it has been read, so that
+    the full element tree is never held in memory.
+
+    Parameters:
+        filepath: The xmi file you want to open.
+    Returns:
+        Dictionary of annotation layers as described in layers_from_xmi().
+    """
+
+    text = None
+
+    def span_elements():
+        nonlocal text
+        for element in iterparse_xmi(filepath):
+            if element.tag == SOFA_TAG:
+                text = element.get('sofaString')
+            else:
+                yield element
+
+    layers = layers_from_spans(span_elements())
+    layers["text"] = text
+
+    return layers
+
+
+def iterparse_xmi(filepath):
+    """
+    Generator that yields the Sofa element and all Span elements
+    of an xmi file as soon as they have been parsed.
+    Each element is cleared once the caller has processed it.
+
+    Parameters:
+        filepath: The xmi file you want to open.
+    Yields:
+        '{http:///uima/cas.ecore}Sofa' and '{http:///custom.ecore}Span'
+        elements in file order.
+    """
+
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if element.tag in (SPAN_TAG, SOFA_TAG):
+            yield element
+
+        # Direct children of the root are never needed again
+        if depth == 1:
+            root.clear()
+
+
+def layers_from_spans(span_list):
+    """
+    Sorts the Span elements of an xmi file into annotation layers,
+    visiting every element only once.
+
+    Parameters:
+        span_list: Iterable of '{http:///custom.ecore}Span' elements.
+    Returns:
+        Dictionary of annotation layers as described in layers_from_xmi(),
+        without the 'text' entry.
+    """
+
+    moral_spans_set = set()
+    detailed_spans_dict = {}
+    obj_morals_list = []
+    subj_morals_list = []
+    protagonist_spans_list = []
+    comfunction_list = []
+    expl_demand_list = []
+    impl_demand_list = []
 
-    # Get all moralizing instances
-    moral_spans_list = []
     for span in span_list:
-        label = span.get('KAT1MoralisierendesSegment')
+        coordinates = (int(span.get("begin")), int(span.get("end")))
 
+        label = span.get('KAT1MoralisierendesSegment')
         if label:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Category":
-                    label
-            }
-            moral_spans_list.append(data_dict)
+            if label != "Keine Moralisierung":
+                moral_spans_set.add(coordinates)
+            # Remove duplicates, but keep the order of the file
+            detailed_spans_dict.setdefault((coordinates, label), {
+                "Coordinates": coordinates,
+                "Category": label
+            })
+
+        category = span.get('Moralwerte')
+        if category:
+            obj_morals_list.append({
+                "Coordinates": coordinates,
+                "Category": category
+            })
+
+        category = span.get('KAT2Subjektive_Ausdrcke')
+        if category:
+            subj_morals_list.append({
+                "Coordinates": coordinates,
+                "Category": category
+            })
+
+        if span.get('Protagonistinnen'):
+            protagonist_spans_list.append({
+                "Coordinates": coordinates,
+                "Rolle": span.get("Protagonistinnen"),
+                "Gruppe": span.get("Protagonistinnen2"),
+                "own/other": span.get("Protagonistinnen3")
+            })
+
+        category = span.get('KommunikativeFunktion')
+        if category:
+            comfunction_list.append({
+                "Coordinates": coordinates,
+                "Category": category
+            })
+
+        category = span.get('Forderung')
+        if category:
+            expl_demand_list.append({
+                "Coordinates": coordinates,
+                "Category": category
+            })
+
+        category = span.get('KAT5Ausformulierung')
+        if category:
+            impl_demand_list.append({
+                "Coordinates": coordinates,
+                "Text": category,
+                "Category": "implizit"
+            })
+
+    return {
+        "moralizations": list(moral_spans_set),
+        "detailed_moralizations": list(detailed_spans_dict.values()),
+        "obj_morals": obj_morals_list,
+        "subj_morals": subj_morals_list,
+        "protagonists_doubles": protagonist_spans_list,
+        "com_functions": comfunction_list,
+        "expl_demands": expl_demand_list,
+        "impl_demands": impl_demand_list
+    }
+
+
+def filter_protagonists(
+    protagonist_spans_list,
+    ignore_list=None,
+    skip_duplicates=False
+):
+    """
+    Filters a list of protagonist annotations as returned by
+    list_protagonists_from_xmi(); see there for the parameters.
+    """
+
+    if ignore_list is None:
+        ignore_list = []
+
+    filtered_list = []
+    seen_coordinates = set()
+    for protagonist in protagonist_spans_list:
+
+        # Ignore categories on the ignore list
+        if (protagonist["Rolle"] in ignore_list
+                or protagonist["Gruppe"] in ignore_list
+                or protagonist["own/other"] in ignore_list):
+            continue
+
+        # and duplicates if skip_duplicates=True
+        if skip_duplicates:
+            if protagonist["Coordinates"] in seen_coordinates:
+                continue
+            seen_coordinates.add(protagonist["Coordinates"])
+
+        filtered_list.append(protagonist)
+
+    return filtered_list
 
-    return list(set(moral_spans_list))  # remove duplicates
+
+def text_from_xmi(filepath):
+    """
+    Extracts the corpus string that the annotations are based on
+    from an xmi file.
+
+    Parameters:
+        filepath: The xmi file you want to open.
+    Returns:
+        The corpus as a string
+    """
+
+    return layers_from_xmi(filepath)["text"]
+
+
+def list_detailed_moralizations_from_xmi(filepath):
+    """
+    Takes an xmi file and returns a list of dictionaries
+    representing all annotations of the moralization category,
+    including non-moralizing segments.
+
+    The dictionaries contain:
+        "Coordinates": 2-tuples marking the beginning and ending of the span
+        "Category": the type of moralization, e.g. "Moralisierung explizit"
+
+    Parameters:
+        filepath: The xmi file you want to open.
+    Returns:
+        List of dictionaries as described above, without duplicates.
+    """
+
+    return layers_from_xmi(filepath)["detailed_moralizations"]
 
 
 def list_moralizations_from_xmi(filepath):
@@ -191,23 +706,7 @@ def list_moralizations_from_xmi(filepath):
         List of 2-tuples.
     """
 
-    # Open the XMI file
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-
-    span_list = root.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    moral_spans_list = []
-    for span in span_list:
-        test = span.get('KAT1MoralisierendesSegment')
-
-        if test:
-            if test != "Keine Moralisierung":
-                coordinates = (int(span.get("begin")), int(span.get("end")))
-                moral_spans_list.append(coordinates)
-
-    return list(set(moral_spans_list))  # remove duplicates
+    return layers_from_xmi(filepath)["moralizations"]
 
 
 def list_protagonists_from_xmi(
@@ -241,53 +740,11 @@ def list_protagonists_from_xmi(
         List of dictionaries as described above.
     """
 
-    if ignore_list is None:
-        ignore_list = []
-
-    # Open the XMI file
-    tree = ET.parse(filepath)
-    span_list = tree.findall("{http:///custom.ecore}Span")
-
-    # Get all protagonist spans
-    protagonist_spans_list = []
-    for span in span_list:
-        test = span.get('Protagonistinnen')
-        if test:
-
-            # Ignore categories on the ignore list
-            # and duplicates if skip_duplicates=True
-            attribute_list = []
-            ignore = False
-            for category in [
-                "Protagonistinnen",
-                "Protagonistinnen2",
-                "Protagonistinnen3"
-            ]:
-                attribute_list.append(span.get(category))
-                for element in ignore_list:
-                    if element in attribute_list:
-                        ignore = True
-
-            if skip_duplicates:
-                coordinates = (int(span.get("begin")), int(span.get("end")))
-                for entry in protagonist_spans_list:
-                    if coordinates == entry["Coordinates"]:
-                        ignore = True
-
-            # Add relevant spans in form of a dictionary containing
-            # coordinates and annotation info such as role or group
-            if not ignore:
-                data_dict = {
-                    "Coordinates": (
-                        int(span.get("begin")), int(span.get("end"))
-                    ),
-                    "Rolle": span.get("Protagonistinnen"),
-                    "Gruppe": span.get("Protagonistinnen2"),
-                    "own/other": span.get("Protagonistinnen3")
-                }
-                protagonist_spans_list.append(data_dict)
-
-    return protagonist_spans_list
+    return filter_protagonists(
+        layers_from_xmi(filepath)["protagonists_doubles"],
+        ignore_list=ignore_list,
+        skip_duplicates=skip_duplicates
+    )
 
 
 def list_obj_moral_from_xmi(filepath):
@@ -304,25 +761,8 @@ def list_obj_moral_from_xmi(filepath):
     Returns:
         List of dictionaries as described above.
     """
-    tree = ET.parse(filepath)
-
-    span_list = tree.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    morals_list = []
-    for span in span_list:
-        category = span.get('Moralwerte')
 
-        if category:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Category":
-                    category
-            }
-            morals_list.append(data_dict)
-
-    return morals_list
+    return layers_from_xmi(filepath)["obj_morals"]
 
 
 def list_subj_moral_from_xmi(filepath):
@@ -339,26 +779,8 @@ def list_subj_moral_from_xmi(filepath):
     Returns:
         List of dictionaries as described above.
     """
-    tree = ET.parse(filepath)
-    root = tree.getroot()
 
-    span_list = root.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    morals_list = []
-    for span in span_list:
-        category = span.get('KAT2Subjektive_Ausdrcke')
-
-        if category:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Category":
-                    category
-            }
-            morals_list.append(data_dict)
-
-    return morals_list
+    return layers_from_xmi(filepath)["subj_morals"]
 
 
 def list_comfunction_from_xmi(filepath):
@@ -376,26 +798,8 @@ def list_comfunction_from_xmi(filepath):
     Returns:
         List of dictionaries as described above.
     """
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-
-    span_list = root.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    comfunction_list = []
-    for span in span_list:
-        category = span.get('KommunikativeFunktion')
 
-        if category:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Category":
-                    category
-            }
-            comfunction_list.append(data_dict)
-
-    return comfunction_list
+    return layers_from_xmi(filepath)["com_functions"]
 
 
 def list_impldemand_from_xmi(filepath):
@@ -414,28 +818,8 @@ def list_impldemand_from_xmi(filepath):
     Returns:
         List of dictionaries as described above.
     """
-    tree = ET.parse(filepath)
-    root = tree.getroot()
 
-    span_list = root.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    demand_list = []
-    for span in span_list:
-        category = span.get('KAT5Ausformulierung')
-
-        if category:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Text":
-                    category,
-                "Category":
-                    "implizit"
-            }
-            demand_list.append(data_dict)
-
-    return demand_list
+    return layers_from_xmi(filepath)["impl_demands"]
 
 
 def list_expldemand_from_xmi(filepath):
@@ -453,23 +837,5 @@ def list_expldemand_from_xmi(filepath):
     Returns:
         List of dictionaries as described above.
     """
-    tree = ET.parse(filepath)
-    root = tree.getroot()
-
-    span_list = root.findall("{http:///custom.ecore}Span")
-
-    # Get all moralizing instances
-    demand_list = []
-    for span in span_list:
-        category = span.get('Forderung')
 
-        if category:
-            data_dict = {
-                "Coordinates":
-                    (int(span.get("begin")), int(span.get("end"))),
-                "Category":
-                    category
-            }
-            demand_list.append(data_dict)
-
-    return demand_list
+    return layers_from_xmi(filepath)["expl_demands"]
@@ -0,0 +1,417 @@
+"""DiMi Matcher
+
+This module finds the words of DiMi, the Dictionary of Moral-Indicating
+Words (see the 'DiMi -- Dictionary of Moral-Indicating Words' directory
+of this repository), in raw text or in token streams.
+
+The entries of a dictionary are loaded once per language and version
+('final' or 'lemmatized') and stored in a hash table that is keyed by
+their first token; multi-word entries such as 'ability to act' are
+checked token by token from there. A text is therefore scanned in
+linear time, no matter how many entries the dictionary has.
+
+Hits are reported like annotations: as dicts with the 'Coordinates'
+of the match, the DiMi 'Entry', its 'Polarity' ('positive' or
+'negative') and whether it is part of the DiMi 'Selection'.
+
+Reading the workbooks with pandas takes seconds, so all eight of them
+can be compiled into one binary lexicon file by running this module
+(python dimi_matcher.py). The file has a versioned header, a table
+of dictionaries, one fixed-size record per entry and a UTF-8 blob of
+the entry strings; it is memory-mapped and only the requested
+dictionary is decoded. dimi_matcher() and dimi_list() use the lexicon
+if it is at least as new as the workbook and fall back to the
+workbook otherwise.
+"""
+
+
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+import pandas as pd
+
+import xmi_analysis_util as xau
+
+
+DIMI_DIRECTORY = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', '..',
+    'DiMi -- Dictionary of Moral-Indicating Words'
+))
+
+DIMI_FILES = {
+    ('de', 'final'): 'Moralization-Dictionary_DE_final.xlsx',
+    ('de', 'lemmatized'): 'Moralization-Dictionary_DE-lemmatized.xlsx',
+    ('en', 'final'): 'Moralization-Dictionary_EN_final.xlsx',
+    ('en', 'lemmatized'): 'Moralization-Dictionary_EN_lemmatized.xlsx',
+    ('fr', 'final'): 'Moralization-Dictionary_FR_final.xlsx',
+    ('fr', 'lemmatized'): 'Moralization-Dictionary_FR_lemmatized.xlsx',
+    ('it', 'final'): 'Moralization-Dictionary_IT_final.xlsx',
+    ('it', 'lemmatized'): 'Moralization-Dictionary_IT_lemmatized.xlsx'
+}
+
+# Sheet names (in lower case) with their polarity and selection flag
+DIMI_SHEETS = {
+    'positive': ('positive', False),
+    'positive selection': ('positive', True),
+    'negative': ('negative', False),
+    'negative selection': ('negative', True)
+}
+
+# Cells that are column headers, not entries
+DIMI_HEADERS = {'Moralwörter lemmatisiert'}
+
+TOKEN_REGEX = re.compile(r'\w+')
+
+# Compiled lexicon, see build_dimi_lexicon()
+LEXICON_FILE = 'dimi_lexicon.bin'
+LEXICON_MAGIC = b'DIMILEX\0'
+LEXICON_VERSION = 1
+# magic, version, number of dictionaries, number of records, blob size
+LEXICON_HEADER = struct.Struct('<8sIIII')
+LEXICON_DICTIONARY = np.dtype([
+    ('language', 'S4'),
+    ('version', 'S12'),
+    ('start', '<u4'),
+    ('stop', '<u4')
+])
+LEXICON_RECORD = np.dtype([
+    ('offset', '<u4'),
+    ('length', '<u2'),
+    ('polarity', 'u1'),
+    ('selection', 'u1')
+])
+POLARITIES = ('negative', 'positive')
+
+# Matchers that were already built, see dimi_matcher()
+_matchers = {}
+
+
+class DimiMatcher:
+    """
+    Hash table over the entries of a DiMi dictionary.
+
+    Attributes
+    ----------
+    entries : list of dicts
+        every entry with its 'Entry' string, its 'Tokens' (casefolded),
+        its 'Polarity' and its 'Selection' flag
+    first_tokens : dict
+        maps a casefolded token to the positions (in entries) of all
+        entries starting with it, longest entries first
+    """
+
+    def __init__(self, entries):
+        """
+        Takes a list of (entry, polarity, selection) tuples, e.g. from
+        read_dimi_xlsx(). Entries listed in several sheets with the
+        same polarity are merged; they count as selection if any of
+        the sheets is a selection sheet.
+        """
+        merged = {}
+        for entry, polarity, selection in entries:
+            tokens = tuple(tokenize(entry))
+            if not tokens:
+                continue
+            key = (tokens, polarity)
+            if key in merged:
+                merged[key]['Selection'] = (merged[key]['Selection']
+                                            or selection)
+            else:
+                merged[key] = {
+                    'Entry': entry,
+                    'Tokens': tokens,
+                    'Polarity': polarity,
+                    'Selection': selection
+                }
+
+        self.entries = list(merged.values())
+        self.first_tokens = {}
+        for i, entry in enumerate(self.entries):
+            self.first_tokens.setdefault(entry['Tokens'][0], []).append(i)
+        for positions in self.first_tokens.values():
+            positions.sort(key=lambda i: -len(self.entries[i]['Tokens']))
+
+    def match_tokens(self, tokens, selection_only=False):
+        """
+        Takes a list of tokens (e.g. lemmas from a tagger).
+        Returns a list of hits, where 'Coordinates' are the indices
+        of the first and behind the last token of the match.
+        """
+        tokens = [token.casefold() for token in tokens]
+        return [
+            self._hit(position, (i, i + length))
+            for i, length, position in self._matches(tokens, selection_only)
+        ]
+
+    def match_text(self, text, selection_only=False):
+        """
+        Takes a string and returns a list of hits, where 'Coordinates'
+        are the character offsets of the match in the string.
+        The string is split into word tokens with the same regular
+        expression that is used for the entries.
+        """
+        tokens = [token.casefold() for token in TOKEN_REGEX.findall(text)]
+        matches = self._matches(tokens, selection_only)
+        if not matches:
+            return []
+
+        # Offsets are only needed if there is a match at all
+        spans = [match.span() for match in TOKEN_REGEX.finditer(text)]
+        return [
+            self._hit(position, (spans[i][0], spans[i + length - 1][1]))
+            for i, length, position in matches
+        ]
+
+    def has_match(self, text, selection_only=False):
+        """
+        Returns True if the string contains at least one entry.
+        Useful to pre-filter large corpora.
+        """
+        tokens = [token.casefold() for token in TOKEN_REGEX.findall(text)]
+        return bool(self._matches(tokens, selection_only, first_only=True))
+
+    def _matches(self, tokens, selection_only, first_only=False):
+        """
+        Finds all entries in a list of casefolded tokens.
+        Returns (token index, length, entry position) triples.
+        """
+        first_tokens = self.first_tokens
+        matches = []
+
+        for i in [i for i, token in enumerate(tokens)
+                  if token in first_tokens]:
+            for position in first_tokens[tokens[i]]:
+                entry = self.entries[position]
+                if selection_only and not entry['Selection']:
+                    continue
+                length = len(entry['Tokens'])
+                if (length > 1
+                        and tuple(tokens[i:i + length]) != entry['Tokens']):
+                    continue
+                matches.append((i, length, position))
+                if first_only:
+                    return matches
+
+        return matches
+
+    def _hit(self, position, coordinates):
+        """Returns the hit dict for an entry found at coordinates."""
+        entry = self.entries[position]
+        return {
+            'Coordinates': coordinates,
+            'Entry': entry['Entry'],
+            'Polarity': entry['Polarity'],
+            'Selection': entry['Selection']
+        }
+
+    def contains(self, token):
+        """
+        Returns True if token (e.g. a lemma) is a single-word entry.
+        """
+        return any(
+            len(self.entries[position]['Tokens']) == 1
+            for position in self.first_tokens.get(token.casefold(), ())
+        )
+
+
+def tokenize(string):
+    """Splits a string into casefolded word tokens."""
+    return [token.casefold() for token in TOKEN_REGEX.findall(string)]
+
+
+def read_dimi_xlsx(filepath):
+    """
+    Reads all sheets of a DiMi workbook.
+    Returns a list of (entry, polarity, selection) tuples.
+    """
+    sheets = pd.read_excel(filepath, sheet_name=None, header=None)
+
+    entries = []
+    for sheet_name, sheet in sheets.items():
+        if sheet_name.lower() not in DIMI_SHEETS:
+            print(f"Unknown DiMi sheet '{sheet_name}' in {filepath}.")
+            continue
+        polarity, selection = DIMI_SHEETS[sheet_name.lower()]
+        for cell in sheet.iloc[:, 0]:
+            if not isinstance(cell, str):
+                continue
+            entry = cell.strip()
+            if entry and entry not in DIMI_HEADERS:
+                entries.append((entry, polarity, selection))
+
+    return entries
+
+
+def build_dimi_lexicon(directory=DIMI_DIRECTORY, filepath=None):
+    """
+    Compiles all DiMi workbooks into one binary lexicon file.
+
+    Parameters:
+        directory: directory containing the DiMi workbooks
+        filepath: path of the lexicon file,
+                  by default LEXICON_FILE in directory
+    Returns:
+        Path of the written file.
+    """
+    if filepath is None:
+        filepath = os.path.join(directory, LEXICON_FILE)
+
+    dictionaries = np.zeros(len(DIMI_FILES), dtype=LEXICON_DICTIONARY)
+    records = []
+    blob = bytearray()
+    for i, ((language, version), filename) in enumerate(DIMI_FILES.items()):
+        dictionaries[i] = (language.encode(), version.encode(),
+                           len(records), 0)
+        for entry, polarity, selection in read_dimi_xlsx(
+                os.path.join(directory, filename)):
+            encoded = entry.encode('utf-8')
+            records.append((len(blob), len(encoded),
+                            POLARITIES.index(polarity), selection))
+            blob += encoded
+        dictionaries[i]['stop'] = len(records)
+    records = np.array(records, dtype=LEXICON_RECORD)
+
+    with xau.atomic_write(filepath) as temp_path, \
+            open(temp_path, 'wb') as f:
+        f.write(LEXICON_HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION,
+                                    len(dictionaries), len(records),
+                                    len(blob)))
+        f.write(dictionaries.tobytes())
+        f.write(records.tobytes())
+        f.write(blob)
+
+    return filepath
+
+
+def read_dimi_lexicon(filepath, language, version='final'):
+    """
+    Reads one dictionary from a lexicon written by build_dimi_lexicon().
+    Returns a list of (entry, polarity, selection) tuples like
+    read_dimi_xlsx(), or None if the file does not exist, cannot be
+    read, has a different lexicon version or lacks the dictionary.
+    """
+    try:
+        with open(filepath, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, lexicon_version, n_dictionaries, n_records, blob_size = \
+                LEXICON_HEADER.unpack_from(data)
+            if magic != LEXICON_MAGIC or lexicon_version != LEXICON_VERSION:
+                return None
+
+            # Slicing the map copies only the bytes that are needed
+            offset = LEXICON_HEADER.size
+            size = n_dictionaries * LEXICON_DICTIONARY.itemsize
+            dictionaries = np.frombuffer(data[offset:offset + size],
+                                         LEXICON_DICTIONARY)
+            records_offset = offset + size
+            blob_offset = records_offset + n_records * LEXICON_RECORD.itemsize
+            if blob_offset + blob_size != len(data):
+                return None
+
+            position = np.flatnonzero(
+                (dictionaries['language'] == language.encode())
+                & (dictionaries['version'] == version.encode())
+            )
+            if not len(position):
+                return None
+            start, stop = dictionaries[['start', 'stop']][position[0]].item()
+            records = np.frombuffer(
+                data[records_offset + start * LEXICON_RECORD.itemsize:
+                     records_offset + stop * LEXICON_RECORD.itemsize],
+                LEXICON_RECORD
+            ).tolist()
+
+            # Only the strings of this dictionary are decoded
+            if records:
+                first = records[0][0]
+                blob = data[blob_offset + first:
+                            blob_offset + records[-1][0] + records[-1][1]]
+            else:
+                first, blob = 0, b''
+    except (OSError, ValueError, struct.error):
+        return None
+
+    return [
+        (blob[start - first:start - first + length].decode('utf-8'),
+         POLARITIES[polarity], bool(selection))
+        for start, length, polarity, selection in records
+    ]
+
+
+def dimi_entries(language, version='final', directory=DIMI_DIRECTORY):
+    """
+    Returns the (entry, polarity, selection) tuples of one DiMi
+    dictionary. They are read from the compiled lexicon in directory
+    if it is at least as new as the workbook, else from the workbook.
+    """
+    filepath = os.path.join(directory, DIMI_FILES[(language, version)])
+    lexicon_path = os.path.join(directory, LEXICON_FILE)
+
+    if (os.path.exists(lexicon_path) and (
+            not os.path.exists(filepath)
+            or os.path.getmtime(lexicon_path) >= os.path.getmtime(filepath))):
+        entries = read_dimi_lexicon(lexicon_path, language, version)
+        if entries is not None:
+            return entries
+
+    return read_dimi_xlsx(filepath)
+
+
+def dimi_list(
+        language,
+        version='final',
+        polarity=None,
+        selection_only=False,
+        directory=DIMI_DIRECTORY
+):
+    """
+    Returns the entries of one DiMi dictionary as a list of strings,
+    e.g. for AnnotationIndex.lookup() or the moral_indicators tools.
+
+    Parameters:
+        language: 'de', 'en', 'fr' or 'it'
+        version: 'final' or 'lemmatized'
+        polarity: 'positive', 'negative' or None for both
+        selection_only: If True, only entries of the DiMi selection.
+        directory: directory containing the DiMi workbooks / lexicon
+    Returns:
+        List of unique entries in the order of the dictionary.
+    """
+    entries = {}
+    for entry, entry_polarity, selection in dimi_entries(
+            language, version, directory):
+        if polarity is not None and entry_polarity != polarity:
+            continue
+        if selection_only and not selection:
+            continue
+        entries[entry] = None
+
+    return list(entries)
+
+
+def dimi_matcher(language, version='final', directory=DIMI_DIRECTORY):
+    """
+    Returns the DimiMatcher for one DiMi dictionary, reading the
+    lexicon or workbook only the first time; see dimi_entries().
+
+    Parameters:
+        language: 'de', 'en', 'fr' or 'it'
+        version: 'final' (for raw text) or 'lemmatized' (for lemmas)
+        directory: directory containing the DiMi workbooks / lexicon
+    Returns:
+        DimiMatcher object.
+    """
+    key = (language, version, directory)
+    if key not in _matchers:
+        _matchers[key] = DimiMatcher(
+            dimi_entries(language, version, directory))
+
+    return _matchers[key]
+
+
+if __name__ == '__main__':
+    print(f"Wrote {build_dimi_lexicon()}")
@@ -0,0 +1,146 @@
+"""Shared NLP Models
+
+This module keeps the spaCy pipelines and HanTa taggers used by the
+analysis tools in a process-wide registry. Loading a model takes
+several seconds, so every model is only loaded the first time it is
+needed and then reused by all analysis functions and all subcorpora
+of a CorpusCollection.
+
+Analyses declare the token attributes they read ('lemma', 'pos');
+only the spaCy components needed for those attributes are loaded,
+so e.g. the parser and NER are skipped for lemma counts.
+Models are registered under (backend, language, components).
+To keep memory bounded when switching between languages, only a
+limited number of models is kept; the least recently used model is
+dropped first. See set_max_models().
+"""
+
+
+from collections import OrderedDict
+
+import spacy
+from HanTa import HanoverTagger as ht
+
+
+# HanTa model files and the matching NLTK tokenizer language
+HANTA_MODELS = {
+    'de': 'morphmodel_ger.pgz',
+    'en': 'morphmodel_en.pgz'
+}
+NLTK_LANGUAGES = {
+    'de': 'german',
+    'en': 'english'
+}
+
+# Components of the *_core_news_md pipelines that produce each token
+# attribute. tok2vec is shared by the trained components; the
+# attribute_ruler maps tags to POS and the French lemmatizer
+# is rule-based on POS.
+ATTRIBUTE_PIPES = {
+    'pos': ('tok2vec', 'tagger', 'morphologizer', 'attribute_ruler'),
+    'lemma': ('tok2vec', 'tagger', 'morphologizer', 'attribute_ruler',
+              'lemmatizer')
+}
+SPACY_PIPES = (
+    'tok2vec', 'tagger', 'morphologizer', 'parser', 'senter',
+    'attribute_ruler', 'lemmatizer', 'ner'
+)
+
+_registry = OrderedDict()
+_max_models = 4
+
+
+def set_max_models(max_models):
+    """
+    Sets how many models are kept loaded at the same time.
+    If more models are needed, the least recently used ones
+    are dropped. None means no limit.
+    """
+    global _max_models
+
+    _max_models = max_models
+    _evict()
+
+
+def clear_models():
+    """Drops all loaded models."""
+    _registry.clear()
+
+
+def required_pipes(attributes):
+    """
+    Takes an iterable of token attributes ('lemma', 'pos').
+    Returns the sorted tuple of spaCy components needed to fill them.
+    """
+    pipes = set()
+    for attribute in attributes:
+        if attribute not in ATTRIBUTE_PIPES:
+            raise ValueError(f"Unknown token attribute: {attribute}")
+        pipes.update(ATTRIBUTE_PIPES[attribute])
+    return tuple(sorted(pipes))
+
+
+def spacy_package(language):
+    """Returns the name of the spaCy pipeline package for a language."""
+    return f'{language}_core_news_md'
+
+
+def get_model(backend, language, attributes=None):
+    """
+    Returns a loaded model, loading it only if it is not
+    in the registry yet.
+
+    Parameters:
+        backend: 'spacy' or 'hanta'
+        language: 'de', 'en', 'fr' or 'it'
+                  (HanTa only supports 'de' and 'en')
+        attributes: spaCy only. Token attributes the caller reads
+                    ('lemma', 'pos'); all other components are excluded
+                    when loading, so an empty tuple loads only the
+                    tokenizer. None loads the full pipeline.
+    Returns:
+        spacy.Language object or HanoverTagger object.
+    """
+    # Attribute sets that need the same components share one model
+    pipes = None if attributes is None else required_pipes(attributes)
+    key = (backend, language, pipes)
+
+    if key in _registry:
+        _registry.move_to_end(key)
+        return _registry[key]
+
+    if backend == 'spacy':
+        if pipes is None:
+            model = spacy.load(spacy_package(language))
+        else:
+            model = spacy.load(
+                spacy_package(language),
+                exclude=[pipe for pipe in SPACY_PIPES if pipe not in pipes]
+            )
+    elif backend == 'hanta':
+        model = ht.HanoverTagger(HANTA_MODELS[language])
+    else:
+        raise ValueError(f"Unknown NLP backend: {backend}")
+
+    _registry[key] = model
+    _evict()
+
+    return model
+
+
+def spacy_model(language, attributes=None):
+    """Returns the spaCy pipeline for a language; see get_model()."""
+    return get_model('spacy', language, attributes)
+
+
+def hanta_tagger(language):
+    """Returns the HanTa tagger for 'de' or 'en'; see get_model()."""
+    return get_model('hanta', language)
+
+
+def _evict():
+    """Drops the least recently used models above the limit."""
+    if _max_models is None:
+        return
+    while len(_registry) > max(_max_models, 0):
+        _registry.popitem(last=False)
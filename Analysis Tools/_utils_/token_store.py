@@ -0,0 +1,489 @@
+"""Token Annotation Store
+
+This module tags the corpus string of a CorpusData object once
+(with spaCy or HanTa) and keeps every token together with its
+character offsets, lemma and POS tag. Lemma, POS and token analyses
+can then look up the tokens of any span instead of running the
+NLP pipeline again for every moralization.
+
+If a cache directory is given, the store is saved there as a
+compressed .npz file, addressed by the hash of the corpus string
+and the model version, and reused in later sessions.
+"""
+
+
+import hashlib
+import itertools
+import os
+from importlib import metadata
+
+import nltk
+import numpy as np
+import spacy
+
+import nlp_models as nm
+import xmi_analysis_util as xau
+
+
+# Increase whenever the stored arrays change,
+# so that old store files are no longer used
+STORE_VERSION = 1
+
+# Longer texts are tagged in chunks of about this many characters;
+# spaCy refuses texts longer than nlp.max_length (1,000,000 by default)
+CHUNK_SIZE = 100000
+
+# nltk's word tokenizer rewrites double quotes
+NLTK_QUOTES = {'``': ('"', '``'), "''": ('"', "''")}
+
+# Tokens are searched for this many characters ahead,
+# so that a skipped token cannot misalign the following ones
+ALIGN_WINDOW = 10
+
+
+class TokenStore:
+    """
+    Tokens of a corpus string with character offsets, lemmas and POS tags.
+
+    Attributes
+    ----------
+    text : str
+        the corpus string the tokens belong to
+    starts, ends : int64 arrays
+        character offsets of every token, sorted
+    lemma_ids, pos_ids : int32 arrays
+        index of the lemma / POS tag of every token in the vocabularies
+    lemma_vocab, pos_vocab : lists of str
+        all distinct lemmas / POS tags
+    model_version : str
+        backend and model the tokens were tagged with
+    """
+
+    def __init__(self, text, starts, ends, lemma_ids, pos_ids,
+                 lemma_vocab, pos_vocab, model_version):
+        self.text = text
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.lemma_ids = np.asarray(lemma_ids, dtype=np.int32)
+        self.pos_ids = np.asarray(pos_ids, dtype=np.int32)
+        self.lemma_vocab = list(lemma_vocab)
+        self.pos_vocab = list(pos_vocab)
+        self.model_version = model_version
+
+    def __len__(self):
+        return len(self.starts)
+
+    def token_range(self, coordinates):
+        """
+        Takes a 2-tuple. Returns the index range (first, last + 1)
+        of the tokens that lie completely inside of it.
+        """
+        first = int(np.searchsorted(self.starts, coordinates[0], 'left'))
+        last = int(np.searchsorted(self.ends, coordinates[1], 'right'))
+        return first, max(first, last)
+
+    def tokens(self, coordinates):
+        """
+        Takes a 2-tuple. Returns the tokens inside of it as
+        (text, lemma, POS) tuples, like HanoverTagger.tag_sent().
+        """
+        first, last = self.token_range(coordinates)
+        return [
+            (self.text[self.starts[i]:self.ends[i]],
+             self.lemma_vocab[self.lemma_ids[i]],
+             self.pos_vocab[self.pos_ids[i]])
+            for i in range(first, last)
+        ]
+
+    def lemmas(self, coordinates):
+        """Takes a 2-tuple. Returns the lemmas of the tokens inside of it."""
+        first, last = self.token_range(coordinates)
+        return [self.lemma_vocab[i] for i in self.lemma_ids[first:last]]
+
+    def pos(self, coordinates):
+        """Takes a 2-tuple. Returns the POS tags of the tokens inside of it."""
+        first, last = self.token_range(coordinates)
+        return [self.pos_vocab[i] for i in self.pos_ids[first:last]]
+
+
+def token_store(corpus, language, hanta=False, cache_dir=None):
+    """
+    Returns the TokenStore of a corpus. The corpus string is only tagged
+    the first time; afterwards the store is taken from the corpus' cache
+    or, if cache_dir is given, from the store file. The store always
+    holds lemmas and POS tags, as the lemma and POS indexes share it.
+
+    Parameters:
+        corpus: CorpusData object
+        language: 'de', 'en', 'fr' or 'it'
+        hanta: If True, tag with HanTa; see nlp_backend().
+        cache_dir: Directory for store files. If None, the store
+                   is only kept in memory.
+    Returns:
+        TokenStore object.
+    """
+    backend = nlp_backend(hanta, language)
+
+    return corpus.cached(
+        ("token_store", backend, language),
+        ("text",),
+        lambda: load_token_store(corpus.text, backend, language, cache_dir)
+    )
+
+
+def nlp_backend(hanta, language):
+    """
+    Returns 'hanta' if HanTa was requested and has a model for the
+    language (only 'de' and 'en'), else 'spacy': other languages
+    fall back to spaCy.
+    """
+    if hanta and language in nm.HANTA_MODELS:
+        return 'hanta'
+    return 'spacy'
+
+
+def load_token_store(text, backend, language, cache_dir=None):
+    """
+    Reads the TokenStore of a text from cache_dir, or tags the text
+    and writes the store there if no matching file exists.
+    """
+    if cache_dir is None:
+        return tag_text(text, backend, language)
+
+    version = model_version(backend, language)
+    store_path = os.path.join(
+        cache_dir,
+        f"{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+        f".{hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]}"
+        f".v{STORE_VERSION}.tokens.npz"
+    )
+
+    store = read_token_store(store_path, text, version)
+    if store is None:
+        store = tag_text(text, backend, language)
+        write_token_store(store_path, store)
+
+    return store
+
+
+def model_version(backend, language):
+    """
+    Returns a string naming the backend and model version used.
+    The versions are read from the installed packages, so that no
+    model has to be loaded for it.
+    """
+
+    if backend == 'hanta':
+        return (f"hanta-{package_version('HanTa')}-"
+                f"{nm.HANTA_MODELS[language]}")
+
+    package = nm.spacy_package(language)
+    return f"spacy-{spacy.__version__}-{package}-{package_version(package)}"
+
+
+def package_version(package):
+    """Returns the installed version of a package, or 'unknown'."""
+
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def read_token_store(store_path, text, version):
+    """
+    Reads a TokenStore written by write_token_store().
+    Returns None if the file does not exist, cannot be read
+    or belongs to a different store or model version.
+    """
+
+    try:
+        with np.load(store_path, allow_pickle=False) as data:
+            if (int(data["store_version"]) != STORE_VERSION
+                    or str(data["model_version"]) != version):
+                return None
+            return TokenStore(
+                text,
+                data["starts"],
+                data["ends"],
+                data["lemma_ids"],
+                data["pos_ids"],
+                data["lemma_vocab"].tolist(),
+                data["pos_vocab"].tolist(),
+                version
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write_token_store(store_path, store):
+    """
+    Stores a TokenStore as a compressed .npz file;
+    see xau.atomic_write().
+    """
+
+    with xau.atomic_write(store_path, suffix='.npz') as temp_path:
+        np.savez_compressed(
+            temp_path,
+            store_version=np.int64(STORE_VERSION),
+            model_version=np.str_(store.model_version),
+            starts=store.starts,
+            ends=store.ends,
+            lemma_ids=store.lemma_ids,
+            pos_ids=store.pos_ids,
+            lemma_vocab=np.array(store.lemma_vocab, dtype=str),
+            pos_vocab=np.array(store.pos_vocab, dtype=str)
+        )
+
+
+def tag_text(text, backend, language, chunk_size=CHUNK_SIZE):
+    """
+    Tags a whole corpus string and returns its TokenStore.
+
+    Parameters:
+        text: corpus string
+        backend: 'spacy' or 'hanta'
+        language: 'de', 'en', 'fr' or 'it'
+        chunk_size: approximate number of characters tagged at once
+    Returns:
+        TokenStore object.
+    """
+    chunks = text_chunks(text, chunk_size)
+
+    return build_store(
+        text,
+        itertools.chain.from_iterable(
+            chunk_tokens(chunks, backend, language)),
+        model_version(backend, language)
+    )
+
+
+def tag_spans(
+        text,
+        spans,
+        language,
+        hanta=False,
+        batch_size=None,
+        n_process=1,
+        attributes=('lemma', 'pos')
+):
+    """
+    Tags every distinct span of a text once, e.g. every moralization,
+    so that all annotations inside a span can be resolved against the
+    same tokens through their character offsets.
+
+    Parameters:
+        text: corpus string
+        spans: iterable of 2-tuples
+        language: 'de', 'en', 'fr' or 'it'
+        hanta: If True, tag with HanTa; see nlp_backend().
+        batch_size, n_process: passed on to spaCy's nlp.pipe
+        attributes: token attributes the caller reads ('lemma', 'pos');
+                    spaCy only loads the components they need, the
+                    others are left empty. HanTa always fills both.
+    Returns:
+        Dictionary mapping every span to a TokenStore
+        that contains only the tokens of that span.
+    """
+    backend = nlp_backend(hanta, language)
+    version = model_version(backend, language)
+
+    spans = list(dict.fromkeys(spans))
+    chunks = [(span[0], text[span[0]:span[1]]) for span in spans]
+    token_lists = chunk_tokens(chunks, backend, language,
+                               split_sentences=False,
+                               batch_size=batch_size,
+                               n_process=n_process,
+                               attributes=attributes)
+
+    return {
+        span: build_store(text, tokens, version)
+        for span, tokens in zip(spans, token_lists)
+    }
+
+
+def moralization_instances(
+        corpus,
+        association,
+        language,
+        hanta=False,
+        batch_size=None,
+        n_process=1,
+        store=None,
+        attributes=('lemma', 'pos')
+):
+    """
+    Yields (moralization, instance, span_store) for every annotation of
+    association (see CorpusData.associations()), where span_store is the
+    TokenStore to look the instance up in. If store is given, it is used
+    for all of them; otherwise every moralization is tagged once with
+    tag_spans(), and the annotations inside of it are found among its
+    tokens by their character offsets.
+
+    Parameters:
+        corpus: CorpusData object
+        association: dictionary mapping moralizations to annotations
+        language: 'de', 'en', 'fr' or 'it'
+        hanta: If True, tag with HanTa; see nlp_backend().
+        batch_size, n_process: passed on to spaCy's nlp.pipe
+        store: TokenStore of the whole corpus, or None
+        attributes: token attributes the caller reads; see tag_spans()
+    Yields:
+        3-tuples, in the order of association.
+    """
+    moralizations = [
+        moralization for moralization, instances in association.items()
+        if instances
+    ]
+
+    if store is not None:
+        span_stores = {moralization: store for moralization in moralizations}
+    else:
+        span_stores = tag_spans(
+            corpus.text,
+            moralizations,
+            language,
+            hanta=hanta,
+            batch_size=batch_size,
+            n_process=n_process,
+            attributes=attributes
+        )
+
+    for moralization, span_store in span_stores.items():
+        for instance in association[moralization]:
+            yield moralization, instance, span_store
+
+
+def build_store(text, tokens, version):
+    """
+    Takes a text, an iterable of (start, end, lemma, POS) tuples and a
+    model version. Returns the TokenStore containing these tokens.
+    """
+    starts, ends, lemma_ids, pos_ids = [], [], [], []
+    lemma_vocab, pos_vocab = {}, {}
+    for start, end, lemma, pos in tokens:
+        starts.append(start)
+        ends.append(end)
+        lemma_ids.append(lemma_vocab.setdefault(lemma, len(lemma_vocab)))
+        pos_ids.append(pos_vocab.setdefault(pos, len(pos_vocab)))
+
+    return TokenStore(text, starts, ends, lemma_ids, pos_ids,
+                      lemma_vocab, pos_vocab, version)
+
+
+def chunk_tokens(chunks, backend, language, split_sentences=True,
+                 batch_size=None, n_process=1, attributes=('lemma', 'pos')):
+    """
+    Tags (offset, chunk) pairs with the given backend. Yields one list
+    of (start, end, lemma, POS) tuples per chunk; the offsets refer to
+    the whole text. See spacy_tokens() and hanta_tokens().
+    """
+    if backend == 'hanta':
+        return hanta_tokens(chunks, language, split_sentences)
+    if backend == 'spacy':
+        return spacy_tokens(chunks, language, batch_size, n_process,
+                            attributes)
+    raise ValueError(f"Unknown NLP backend: {backend}")
+
+
+def text_chunks(text, chunk_size=CHUNK_SIZE):
+    """
+    Splits a string into (offset, chunk) pairs of at most chunk_size
+    characters. Chunks end at a line break or, if there is none,
+    at a space, so that no token is cut in two.
+    """
+    chunks = []
+    offset = 0
+
+    while len(text) - offset > chunk_size:
+        limit = offset + chunk_size
+        end = text.rfind('\n', offset, limit)
+        if end <= offset:
+            end = text.rfind(' ', offset, limit)
+        if end <= offset:
+            end = limit
+        else:
+            end += 1
+        chunks.append((offset, text[offset:end]))
+        offset = end
+
+    if offset < len(text):
+        chunks.append((offset, text[offset:]))
+
+    return chunks
+
+
+def spacy_tokens(chunks, language, batch_size=None, n_process=1,
+                 attributes=('lemma', 'pos')):
+    """
+    Yields a list of (start, end, lemma, POS) spaCy tokens per chunk.
+    Only the components needed for attributes are loaded; lemmas or
+    POS tags that were not requested are left empty.
+    """
+
+    model = nm.spacy_model(language, attributes=attributes)
+    docs = model.pipe((chunk for offset, chunk in chunks),
+                      batch_size=batch_size,
+                      n_process=n_process)
+
+    for (offset, chunk), doc in zip(chunks, docs):
+        yield [
+            (offset + token.idx,
+             offset + token.idx + len(token.text),
+             token.lemma_,
+             token.pos_)
+            for token in doc
+        ]
+
+
+def hanta_tokens(chunks, language, split_sentences=True):
+    """
+    Yields a list of (start, end, lemma, POS) per chunk for the tokens
+    found by nltk's word tokenizer, tagged with HanTa sentence by
+    sentence (or the whole chunk as one sentence if split_sentences
+    is False). Tokens that cannot be found in the text are skipped.
+    """
+
+    tagger = nm.hanta_tagger(language)
+    nltk_language = nm.NLTK_LANGUAGES[language]
+
+    for offset, chunk in chunks:
+        if split_sentences:
+            sentences = nltk.tokenize.sent_tokenize(
+                chunk, language=nltk_language)
+        else:
+            sentences = [chunk]
+
+        tokens = []
+        cursor = 0
+        for sentence in sentences:
+            tokenized = nltk.tokenize.word_tokenize(
+                sentence, language=nltk_language)
+            tags = tagger.tag_sent(tokenized)
+
+            for (word, lemma, pos) in tags:
+                start, end = align_token(chunk, word, cursor)
+                if start < 0:
+                    continue
+                cursor = end
+                tokens.append((offset + start, offset + end, lemma, pos))
+
+        yield tokens
+
+
+def align_token(text, token, cursor):
+    """
+    Finds a token in text, at most ALIGN_WINDOW characters
+    after the whitespace following cursor.
+    Returns its (start, end) offsets, or (-1, -1) if it was not found.
+    """
+
+    while cursor < len(text) and text[cursor].isspace():
+        cursor += 1
+
+    for form in NLTK_QUOTES.get(token, (token,)):
+        start = text.find(form, cursor, cursor + ALIGN_WINDOW + len(form))
+        if start >= 0:
+            return start, start + len(form)
+
+    return -1, -1
@@ -1,22 +1,84 @@
+import bisect
+import contextlib
+import itertools
 import numpy as np
+import scipy.stats as stats
+from scipy.special import gammaln
 import xlsxwriter
 import os
 
 
+# log(k!) for k = 0, 1, 2, ...; extended by log_factorials() when needed,
+# but never beyond LOG_FACTORIAL_LIMIT values
+_log_factorial_table = np.zeros(1)
+
+# fisher_exact_batch() sums up the probabilities of all possible tables
+# directly if there are at most FISHER_DIRECT_SUPPORT of them,
+# evaluating at most FISHER_CHUNK probabilities at once
+FISHER_DIRECT_SUPPORT = 4096
+FISHER_CHUNK = 1 << 22
+
+# log(k!) is looked up in a table for k below this limit (8 MB at most)
+# and computed with gammaln() above it
+LOG_FACTORIAL_LIMIT = 1 << 20
+
+
+class SpanIndex:
+    """
+    Sorted index over a list of 2-tuples (e.g. the moralizations
+    of a corpus). Finds a span that contains given coordinates
+    with a binary search instead of a scan over the whole list.
+
+    Attributes
+    ----------
+    spans : list of 2-tuples
+        the indexed spans, sorted by beginning and end
+    starts : list of int
+        the beginnings of the sorted spans
+    max_ends : list of int
+        the largest end of all spans up to each position
+    """
+
+    def __init__(self, coord_list):
+        self.spans = sorted(set(coord_list))
+        self.starts = [span[0] for span in self.spans]
+        self.max_ends = list(itertools.accumulate(
+            (span[1] for span in self.spans), max))
+
+    def containing(self, coord_tuple):
+        """
+        Returns the span with the latest beginning that contains
+        coord_tuple, or None if there is no such span.
+        """
+        i = bisect.bisect_right(self.starts, coord_tuple[0]) - 1
+
+        # Only overlapping spans make it necessary to look further back
+        while i >= 0 and self.max_ends[i] >= coord_tuple[1]:
+            if self.spans[i][1] >= coord_tuple[1]:
+                return self.spans[i]
+            i -= 1
+        return None
+
+
 def inside_of(coord_list, coord_tuple):
     """
     Checks whether the specific coordinates of coord_tuple
     are inside any of the coordinates on the list.
     Returns the first match, or None if there is no match.
+    coord_list may also be a SpanIndex, which is much faster
+    for repeated lookups.
     """
 
+    if isinstance(coord_list, SpanIndex):
+        return coord_list.containing(coord_tuple)
+
     for coord in coord_list:
         if coord_tuple[0] >= coord[0] and coord_tuple[1] <= coord[1]:
             return coord
     return None
 
 
-def label_associations(moral_spans_list, label_spans_list):
+def label_associations(moral_spans_list, label_spans_list, index=None):
     """
     Takes a list of moral spans and a list of annotation dicts
     to create a dictionary where the keys are 2-tuples of the
@@ -27,15 +89,19 @@ def label_associations(moral_spans_list, label_spans_list):
     'KeyError' to the console. This means that something was
     falsely annotated, not that the function itself is
     experiencing an error!
+    A prebuilt SpanIndex over moral_spans_list (such as
+    CorpusData.moralization_index) can be passed as index.
     """
 
+    if index is None:
+        index = SpanIndex(moral_spans_list)
+
     dictionary = {}
 
     for moralization in moral_spans_list:
         dictionary[moralization] = []
     for label in label_spans_list:
-        moral_span = inside_of(
-            moral_spans_list, label["Coordinates"])
+        moral_span = index.containing(label["Coordinates"])
         try:
             dictionary[moral_span].append(label["Coordinates"])
         except KeyError:
@@ -44,7 +110,11 @@ def label_associations(moral_spans_list, label_spans_list):
     return dictionary
 
 
-def label_associations_category(moral_spans_list, label_spans_list):
+def label_associations_category(
+    moral_spans_list,
+    label_spans_list,
+    index=None
+):
     """
     Takes a list of moral spans and a list of annotation dicts
     to create a dictionary where the keys are 2-tuples of the
@@ -55,15 +125,19 @@ def label_associations_category(moral_spans_list, label_spans_list):
     'KeyError' to the console. This means that something was
     falsely annotated, not that the function itself is
     experiencing an error!
+    A prebuilt SpanIndex over moral_spans_list (such as
+    CorpusData.moralization_index) can be passed as index.
     """
 
+    if index is None:
+        index = SpanIndex(moral_spans_list)
+
     dictionary = {}
 
     for moralization in moral_spans_list:
         dictionary[moralization] = []
     for label in label_spans_list:
-        moral_span = inside_of(
-            moral_spans_list, label["Coordinates"])
+        moral_span = index.containing(label["Coordinates"])
         try:
             dictionary[moral_span].append(label)
         except KeyError:
@@ -90,14 +164,32 @@ def get_span(text, coordinates):
 
 def special_upper(string):
     """Works like the upper() method, exept it does not turn 'ß' into 'SS'."""
-    newstring = ''
-    for i in range(len(string)):
-        if (string[i]) != 'ß':
-            newstring = ''.join((newstring, string[i].upper()))
-        else:
-            newstring = ''.join((newstring, string[i]))
+    return 'ß'.join(part.upper() for part in string.split('ß'))
+
 
-    return newstring
+def highlight_span(text, coordinates, highlights):
+    """
+    Takes a corpus string, a 2-tuple (e.g. a moralization) and a list
+    of 2-tuples inside of it (e.g. its annotations). Returns the slice
+    of the first 2-tuple, with all highlighted parts converted by
+    special_upper(). Only the slice itself is copied, never the
+    whole corpus string.
+    """
+    begin, end = coordinates
+    pieces = []
+    position = begin
+
+    for start, stop in sorted(highlights):
+        start = max(start, position)
+        stop = min(stop, end)
+        if start >= stop:
+            continue
+        pieces.append(text[position:start])
+        pieces.append(special_upper(text[start:stop]))
+        position = stop
+
+    pieces.append(text[position:end])
+    return ''.join(pieces)
 
 
 def label_in_list(anno_list, category):
@@ -112,6 +204,50 @@ def label_in_list(anno_list, category):
     return False
 
 
+def count_labels(anno_list, key, labels):
+    """
+    Counts in a single pass how often every label occurs as the
+    value of key (e.g. 'Category' or 'Rolle') in a list of
+    annotation dicts. Values that are not among the labels
+    are ignored.
+
+    Returns:
+        - integer array with one count per label, in the order of labels.
+    """
+    label_index = {label: i for i, label in enumerate(labels)}
+
+    indices = [label_index[annotation[key]] for annotation in anno_list
+               if annotation[key] in label_index]
+
+    return np.bincount(np.asarray(indices, dtype=np.int64),
+                       minlength=len(labels))
+
+
+def count_label_pairs(anno_list, key1, labels1, key2, labels2):
+    """
+    Counts in a single pass how often every pair of labels occurs
+    as the values of key1 and key2 (e.g. 'Gruppe' and 'Rolle') of
+    the same annotation. Annotations with a value that is not among
+    the labels are ignored.
+
+    Returns:
+        - integer array of shape (len(labels1), len(labels2)).
+    """
+    index1 = {label: i for i, label in enumerate(labels1)}
+    index2 = {label: i for i, label in enumerate(labels2)}
+
+    indices = [
+        index1[annotation[key1]] * len(labels2) + index2[annotation[key2]]
+        for annotation in anno_list
+        if annotation[key1] in index1 and annotation[key2] in index2
+    ]
+
+    return np.bincount(
+        np.asarray(indices, dtype=np.int64),
+        minlength=len(labels1) * len(labels2)
+    ).reshape(len(labels1), len(labels2))
+
+
 def possible_labels(category):
     """
     Returns lists of possible labels for any given
@@ -207,6 +343,238 @@ def calculate_normalized_pmi(contingency_table):
     return (pmi / jsi)
 
 
+def normalized_pmi_batch(tables):
+    """
+    Works like calculate_normalized_pmi(), but for any number of
+    contingency tables at once.
+
+    Parameters:
+        - tables: array-like of shape (..., 2, 2), e.g. as created
+          by contingency_cube().
+
+    Returns:
+        - float array of shape (...) with the normalized PMI values.
+    """
+    tables = np.asarray(tables, dtype=np.float64)
+    counter_12 = tables[..., 0, 0]
+    counter_1 = tables[..., 0, 1]
+    counter_2 = tables[..., 1, 0]
+    total_segments = tables.sum(axis=(-2, -1))
+
+    p_x = counter_12 + counter_1
+    p_y = counter_12 + counter_2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pmi = np.log2(counter_12 / ((p_x * p_y) / total_segments))
+        jsi = -1 * np.log2(counter_12 / total_segments)
+        pmi_norm = pmi / jsi
+
+    # Avoid log(0)
+    pmi_norm[(counter_12 == 0) | (p_x == 0) | (p_y == 0)] = float('-inf')
+
+    return pmi_norm
+
+
+def log_factorials(k):
+    """
+    Takes an int array. Returns log(k!) for all of its values.
+    Values below LOG_FACTORIAL_LIMIT are looked up in a cached table,
+    which only grows as far as needed; larger values are computed
+    with gammaln(), so the cache never depends on the corpus size.
+    """
+    global _log_factorial_table
+
+    k = np.asarray(k, dtype=np.int64)
+    small = k < LOG_FACTORIAL_LIMIT
+    needed = int(k[small].max(initial=0)) + 1
+
+    if len(_log_factorial_table) < needed:
+        size = min(max(needed, 2 * len(_log_factorial_table)),
+                   LOG_FACTORIAL_LIMIT)
+        _log_factorial_table = gammaln(np.arange(size) + 1)
+
+    if small.all():
+        return _log_factorial_table[k]
+
+    result = gammaln(k + 1.0)
+    result[small] = _log_factorial_table[k[small]]
+    return result
+
+
+def fisher_exact_batch(tables):
+    """
+    Two-sided p-values of Fisher's exact test (as returned by
+    scipy.stats.fisher_exact()) for any number of contingency tables.
+
+    All tables with the same margins follow a hypergeometric
+    distribution, which has a single mode. The p-value is the summed
+    probability of all tables that are at most as likely as the observed
+    one. If there are only few possible tables (as for rare terms),
+    their probabilities are summed up directly. Otherwise, the p-value
+    is the tail on the side of the observed table, plus the part of
+    the other tail that is found with a binary search.
+
+    Parameters:
+        - tables: array-like of shape (..., 2, 2), e.g. as created
+          by contingency_cube().
+
+    Returns:
+        - float array of shape (...) with the p-values.
+    """
+    tables = np.asarray(tables, dtype=np.int64)
+    shape = tables.shape[:-2]
+    tables = tables.reshape(-1, 2, 2)
+
+    observed = tables[:, 0, 0]
+    row_1 = tables[:, 0].sum(axis=1)
+    col_1 = tables[:, :, 0].sum(axis=1)
+    total = tables.sum(axis=(1, 2))
+
+    lowest = np.maximum(0, row_1 + col_1 - total)
+    highest = np.minimum(row_1, col_1)
+    mode = (row_1 + 1) * (col_1 + 1) // (total + 2)
+
+    log_margins = (log_factorials(row_1) + log_factorials(total - row_1)
+                   + log_factorials(col_1) + log_factorials(total - col_1)
+                   - log_factorials(total))
+
+    def log_pmf(x, rows=slice(None)):
+        x = np.clip(x, lowest[rows], highest[rows])
+        return (log_margins[rows] - log_factorials(x)
+                - log_factorials(row_1[rows] - x)
+                - log_factorials(col_1[rows] - x)
+                - log_factorials(total[rows] - row_1[rows] - col_1[rows] + x))
+
+    # Relative tolerance for tables that are as likely as the observed one
+    threshold = log_pmf(observed) + np.log1p(1e-7)
+
+    pvalue = np.empty(len(tables))
+
+    # Few possible tables: sum up all probabilities below the threshold,
+    # in chunks of at most FISHER_CHUNK values
+    support = highest - lowest + 1
+    direct = np.flatnonzero(support <= FISHER_DIRECT_SUPPORT)
+    chunk_ends = np.searchsorted(
+        np.cumsum(support[direct]),
+        np.arange(FISHER_CHUNK, support[direct].sum() + FISHER_CHUNK,
+                  FISHER_CHUNK),
+        side='right'
+    )
+    chunk_start = 0
+    for chunk_end in np.append(chunk_ends, len(direct)):
+        rows = direct[chunk_start:chunk_end]
+        chunk_start = chunk_end
+        if len(rows) == 0:
+            continue
+        sizes = support[rows]
+        owner = np.repeat(np.arange(len(rows)), sizes)
+        x = (np.repeat(lowest[rows], sizes)
+             + np.arange(sizes.sum())
+             - np.repeat(np.cumsum(sizes) - sizes, sizes))
+        log_p = log_pmf(x, rows[owner])
+        probabilities = np.where(log_p <= threshold[rows][owner],
+                                 np.exp(log_p), 0.0)
+        pvalue[rows] = np.bincount(owner, weights=probabilities,
+                                   minlength=len(rows))
+
+    # Many possible tables: use the tails of the distribution
+    rows = np.flatnonzero(support > FISHER_DIRECT_SUPPORT)
+    if len(rows):
+        pvalue[rows] = fisher_tails(
+            observed[rows], lowest[rows], highest[rows], mode[rows],
+            threshold[rows], total[rows], row_1[rows], col_1[rows],
+            lambda x, subset: log_pmf(x, rows[subset])
+        )
+
+    # The observed table is the only possible one; the sum of its
+    # log-factorials need not cancel out exactly
+    pvalue[support == 1] = 1.0
+
+    return np.minimum(pvalue, 1.0).reshape(shape)
+
+
+def fisher_tails(observed, lowest, highest, mode, threshold,
+                 total, row_1, col_1, log_pmf):
+    """
+    Helper of fisher_exact_batch(): p-values as the tail on the side of
+    the observed table plus the part of the other tail that is at most
+    as likely, found with a binary search on both sides of the mode.
+    log_pmf(x, subset) returns the log probabilities of the tables x.
+    """
+    everything = np.arange(len(observed))
+    below = observed < mode
+
+    # Observed table left of the mode: find the first table right
+    # of the mode that is at most as likely (highest + 1 if none)
+    left, right = mode + 1, highest + 1
+    active = below & (left < right)
+    while active.any():
+        middle = (left + right) // 2
+        unlikely = log_pmf(middle, everything) <= threshold
+        right = np.where(active & unlikely, middle, right)
+        left = np.where(active & ~unlikely, middle + 1, left)
+        active = below & (left < right)
+    first_upper = left
+
+    # Observed table right of the mode: find the last table left
+    # of the mode that is at most as likely (lowest - 1 if none)
+    left, right = lowest - 1, mode - 1
+    active = ~below & (left < right)
+    while active.any():
+        middle = (left + right + 1) // 2
+        unlikely = log_pmf(middle, everything) <= threshold
+        left = np.where(active & unlikely, middle, left)
+        right = np.where(active & ~unlikely, middle - 1, right)
+        active = ~below & (left < right)
+    last_lower = left
+
+    hypergeom = stats.hypergeom(total, row_1, col_1)
+    pvalue = np.where(
+        below,
+        hypergeom.cdf(observed) + hypergeom.sf(first_upper - 1),
+        hypergeom.sf(observed - 1) + hypergeom.cdf(last_lower)
+    )
+
+    # Every table is at most as likely as the observed one
+    pvalue[log_pmf(mode, everything) <= threshold] = 1.0
+
+    return pvalue
+
+
+def benjamini_hochberg(pvalues):
+    """
+    Adjusts p-values for multiple testing with the Benjamini-Hochberg
+    procedure (false discovery rate). NaN values are ignored and stay
+    NaN; they do not count as tests.
+
+    Parameters:
+        - pvalues: array-like of p-values
+
+    Returns:
+        - float array of the same shape with the adjusted p-values.
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    adjusted = np.full(pvalues.shape, np.nan)
+
+    valid = ~np.isnan(pvalues)
+    tested = pvalues[valid]
+    n_tests = len(tested)
+    if n_tests == 0:
+        return adjusted
+
+    order = np.argsort(tested)
+    ranked = tested[order] * n_tests / np.arange(1, n_tests + 1)
+
+    # Each adjusted p-value is the smallest of all values ranked above it
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+
+    result = np.empty(n_tests)
+    result[order] = np.minimum(ranked, 1.0)
+    adjusted[valid] = result
+
+    return adjusted
+
+
 def freq_table(corpus, associations1, associations2, label1, label2):
     """
     Creates a contigency table for two annotation labels. Looks whether
@@ -247,6 +615,61 @@ def freq_table(corpus, associations1, associations2, label1, label2):
     return contingency_table
 
 
+def presence_matrix(moral_spans_list, associations, labels):
+    """
+    Encodes for every moralizing segment which labels are present
+    at least once among its annotations (in the sense of label_in_list()).
+
+    Parameters:
+        - moral_spans_list: list of 2-tuples of moralizations
+        - associations: dict as created by label_associations_category()
+        - labels: list of labels (such as possible_labels('all_morals'))
+
+    Returns:
+        - boolean array with one row per moralization
+          and one column per label.
+    """
+    label_index = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(moral_spans_list), len(labels)), dtype=bool)
+
+    for row, moralization in enumerate(moral_spans_list):
+        for annotation in associations[moralization]:
+            for value in annotation.values():
+                col = label_index.get(value)
+                if col is not None:
+                    matrix[row, col] = True
+
+    return matrix
+
+
+def contingency_cube(matrix1, matrix2):
+    """
+    Creates the contingency tables (see freq_table()) for all pairs
+    of labels at once from two presence matrices over the same
+    moralizations, as created by presence_matrix().
+
+    Parameters:
+        - matrix1: boolean array of shape (moralizations, labels1)
+        - matrix2: boolean array of shape (moralizations, labels2)
+
+    Returns:
+        - integer array of shape (labels1, labels2, 2, 2); the entry
+          [i, j] is the contingency table of labels1[i] and labels2[j].
+    """
+    matrix1 = matrix1.astype(np.int64)
+    matrix2 = matrix2.astype(np.int64)
+
+    counter_12 = matrix1.T @ matrix2
+    counter_1 = matrix1.sum(axis=0)[:, np.newaxis] - counter_12
+    counter_2 = matrix2.sum(axis=0)[np.newaxis, :] - counter_12
+    counter_none = len(matrix1) - counter_12 - counter_1 - counter_2
+
+    return np.stack([
+        np.stack([counter_12, counter_1], axis=-1),
+        np.stack([counter_2, counter_none], axis=-1)
+    ], axis=-2)
+
+
 def list_to_excel(source_list, filepath):
     """
     Takes a list and writes it into the first column
@@ -315,6 +738,27 @@ def valid_category(category):
     return True
 
 
+@contextlib.contextmanager
+def atomic_write(filepath, suffix=''):
+    """
+    Yields a temporary path to write a file to, which is moved to
+    filepath in a single step when the block is left. Concurrent
+    readers thus never see a half-written file. The directory is
+    created if needed; the temporary file is removed on errors.
+    suffix is appended to the temporary name (e.g. '.npz' for numpy,
+    which otherwise appends it itself).
+    """
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+
+    temp_path = f"{filepath}.{os.getpid()}.tmp{suffix}"
+    try:
+        yield temp_path
+        os.replace(temp_path, filepath)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
 def list_xmis_in_directory(directory):
     """Creates a list of absolute filepaths to all xmis in a directory.
 
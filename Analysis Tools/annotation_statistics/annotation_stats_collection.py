@@ -1,16 +1,39 @@
 import sys
-import contextlib
 import label_analysis as la
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-import scipy.stats as stats
-import annotation_stats_single as astats
 
 sys.path.append("../_utils_")
 import xmi_analysis_util as xau
 
 
+# Protagonist groups as shown in the tables and as annotated
+GROUP_NAMES = xau.possible_labels('prot_groups')
+PROTAGONIST_GROUPS = [
+    'OTHER' if group == 'Sonstige' else group for group in GROUP_NAMES
+]
+
+
+def labels_per_moralization(corpus, label_type):
+    """
+    Returns an integer array whose i-th entry is the number of
+    moralizations in a CorpusData object that contain exactly i
+    annotations of label_type. The array is cached in the corpus.
+    """
+    return corpus.cached(
+        ("labels_per_moralization", label_type),
+        ("moralizations", label_type),
+        lambda: np.bincount(
+            np.asarray([len(labels) for labels
+                        in corpus.associations(label_type).values()],
+                       dtype=np.int64),
+            minlength=1
+        )
+    )
+
+
 def moral_values_freq_collection(corpus_collection,
                                  moral_type="all",
                                  sum_dimensions=False,
@@ -38,56 +61,32 @@ def moral_values_freq_collection(corpus_collection,
         print("Error: Moral_type parameter must be 'all', 'obj', or 'subj'.")
         return
 
-    df = None
+    moral_layer = {
+        'all': 'all_morals',
+        'obj': 'obj_morals',
+        'subj': 'subj_morals'
+    }[moral_type]
+
+    labels = xau.possible_labels(moral_layer)
+    counts = corpus_collection.label_counts(moral_layer, 'Category', labels)
+
     if sum_dimensions:
-        df = {
-            'Moralwert': [
-                'Care/harm',
-                'Fairness/cheating',
-                'Loyalty/betrayal',
-                'Authority/subversion',
-                'Sanctity/degradation',
-                'Liberty/oppression',
-                'OTHER',
-                'Summe'
-            ],
-            'Vorkommen': [
-                0, 0, 0, 0, 0, 0, 0, 0
-            ]
-        }
-    else:
-        df = {
-            'Moralwert': [
-                'Care',
-                'Harm',
-                'Fairness',
-                'Cheating',
-                'Loyalty',
-                'Betrayal',
-                'Authority',
-                'Subversion',
-                'Sanctity',
-                'Degradation',
-                'Liberty',
-                'Oppression',
-                'OTHER',
-                'Summe'
-            ],
-            'Vorkommen': [
-                0, 0, 0, 0, 0, 0, 0,
-                0, 0, 0, 0, 0, 0, 0
-            ]
-        }
-    df = pd.DataFrame(df)
+        labels = [
+            'Care/harm',
+            'Fairness/cheating',
+            'Loyalty/betrayal',
+            'Authority/subversion',
+            'Sanctity/degradation',
+            'Liberty/oppression',
+            'OTHER'
+        ]
+        # Add up the two sides of each dimension
+        counts = np.append(counts[:12].reshape(6, 2).sum(axis=1), counts[12])
 
-    for corpus in corpus_collection.collection.values():
-        # Surpress print statements in function
-        with contextlib.redirect_stdout(None):
-            sub_df = astats.moral_values_freq(corpus,
-                                              moral_type,
-                                              sum_dimensions)
-        df['Vorkommen'] = df['Vorkommen'].add(sub_df['Vorkommen'],
-                                              axis='index')
+    df = pd.DataFrame({
+        'Moralwert': labels + ['Summe'],
+        'Vorkommen': np.append(counts, counts.sum())
+    })
 
     if plot:
         df_nosum = df[df['Moralwert'] != 'Summe']
@@ -122,28 +121,17 @@ def protagonist_role_freq_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df = {
-        'Rolle': [
-            'Adresassat:in',
-            'Benefizient:in',
-            'Forderer:in',
-            'Malefizient:in',
-            'Kein Bezug',
-            'Bezug unklar',
-            'Bezug unklar/kein Bezug',
-            'Summe'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0, 0, 0
-        ]
-    }
+    roles = xau.possible_labels('prot_roles')
+    df = {'Rolle': roles + ['Bezug unklar/kein Bezug', 'Summe']}
+    # The last two rows are filled in below
+    df['Vorkommen'] = np.append(
+        corpus_collection.label_counts('protagonists_doubles',
+                                       'Rolle',
+                                       roles),
+        [0, 0]
+    )
     df = pd.DataFrame(df)
 
-    for corpus in corpus_collection.collection.values():
-        for protagonist in corpus.protagonists_doubles:
-            if protagonist['Rolle'] in df['Rolle'].values:
-                df.loc[df['Rolle'] == protagonist['Rolle'], 'Vorkommen'] += 1
-
     if corpus_collection.language.lower() == 'all':
         df.at[7, 'Vorkommen'] = df['Vorkommen'].sum()
         df.at[6, 'Vorkommen'] = df.at[4, 'Vorkommen'] + df.at[5, 'Vorkommen']
@@ -190,28 +178,13 @@ def protagonist_group_freq_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df = {
-        'Gruppe': [
-            'Individuum',
-            'Institution',
-            'Menschen',
-            'soziale Gruppe',
-            'OTHER',
-            'Summe'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0
-        ]
-    }
+    df = {'Gruppe': PROTAGONIST_GROUPS + ['Summe']}
+    counts = corpus_collection.label_counts('protagonists',
+                                            'Gruppe',
+                                            PROTAGONIST_GROUPS)
+    df['Vorkommen'] = np.append(counts, counts.sum())
     df = pd.DataFrame(df)
 
-    for corpus in corpus_collection.collection.values():
-        # Surpress print statements in function
-        with contextlib.redirect_stdout(None):
-            sub_df = astats.protagonist_group_freq(corpus)
-        df['Vorkommen'] = df['Vorkommen'].add(sub_df['Vorkommen'],
-                                              axis='index')
-
     df['Anteil'] = (df['Vorkommen'] / df['Vorkommen'][5])
 
     if plot:
@@ -247,25 +220,12 @@ def protagonist_ownother_freq_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df = {
-        'Own/Other': [
-            'Own Group',
-            'Other Group',
-            'Neutral',
-        ],
-        'Vorkommen': [
-            0, 0, 0
-        ]
-    }
+    df = {'Own/Other': xau.possible_labels('prot_ownother')}
+    df['Vorkommen'] = corpus_collection.label_counts('protagonists',
+                                                     'own/other',
+                                                     df['Own/Other'])
     df = pd.DataFrame(df)
 
-    for corpus in corpus_collection.collection.values():
-        # Surpress print statements in function
-        with contextlib.redirect_stdout(None):
-            sub_df = astats.protagonist_ownother_freq(corpus)
-        df['Vorkommen'] = df['Vorkommen'].add(sub_df['Vorkommen'],
-                                              axis='index')
-
     if plot:
         df_nosum = df[df['Own/Other'] != 'Summe']
         plt.bar(df_nosum['Own/Other'], df_nosum['Vorkommen'])
@@ -295,30 +255,17 @@ def comfunction_freq_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df = {
-        'Kommunikative Funktion': [
-            'Appell',
-            'Beziehung',
-            'Darstellung',
-            'Expression',
-            'Appell+Beziehung',
-            'Appell+Darstellung',
-            'Appell+Expression',
-            'Summe'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0, 0, 0
-        ]
-    }
+    functions = xau.possible_labels('com_functions')
+    df = {'Kommunikative Funktion': functions + ['Summe']}
+    # The sum is filled in below
+    df['Vorkommen'] = np.append(
+        corpus_collection.label_counts('com_functions',
+                                       'Category',
+                                       functions),
+        0
+    )
     df = pd.DataFrame(df)
 
-    for corpus in corpus_collection.collection.values():
-        for comfunction in corpus.com_functions:
-            if (comfunction['Category']
-                    in df['Kommunikative Funktion'].values):
-                df.loc[df['Kommunikative Funktion'] ==
-                       comfunction['Category'], 'Vorkommen'] += 1
-
     df.at[4, 'Vorkommen'] = df.at[1, 'Vorkommen'] + df.at[4, 'Vorkommen']
     df.at[5, 'Vorkommen'] = df.at[2, 'Vorkommen'] + df.at[5, 'Vorkommen']
     df.at[6, 'Vorkommen'] = df.at[3, 'Vorkommen'] + df.at[6, 'Vorkommen']
@@ -367,20 +314,15 @@ def demand_freq_collection(corpus_collection,
             'Explizite Forderung',
             'Implizite Forderung',
             'Summe'
-        ],
-        'Vorkommen': [
-            0, 0, 0
         ]
     }
+    expl_count = sum(len(corpus.expl_demands)
+                     for corpus in corpus_collection.collection.values())
+    impl_count = sum(len(corpus.impl_demands)
+                     for corpus in corpus_collection.collection.values())
+    df['Vorkommen'] = [expl_count, impl_count, expl_count + impl_count]
     df = pd.DataFrame(df)
 
-    for corpus in corpus_collection.collection.values():
-        # Surpress print statements in function
-        with contextlib.redirect_stdout(None):
-            sub_df = astats.demand_freq(corpus)
-        df['Vorkommen'] = df['Vorkommen'].add(sub_df['Vorkommen'],
-                                              axis='index')
-
     if plot:
         df_nosum = df[df['Forderungstyp'] != 'Summe']
         plt.bar(df_nosum['Forderungstyp'], df_nosum['Vorkommen'])
@@ -423,19 +365,19 @@ def freq_inside_spans_collection(corpus_collection,
               "\n".join(label_possibilities))
         return
 
-    df = {'Label in einer Moralis.': [0, 'Summe'],
-          'Häufigkeit': [0, 0]}
-    df = pd.DataFrame(df)
-
+    counts = np.zeros(1, dtype=np.int64)
     for corpus in corpus_collection.collection.values():
-        # Surpress print statements in function
-        with contextlib.redirect_stdout(None):
-            sub_df = astats.freq_inside_spans(corpus, label_type)
-        df = pd.concat([df, sub_df], ignore_index=True)
-        df = df.groupby('Label in einer Moralis.', as_index=False).sum()
-
-    sum = df.loc[df['Label in einer Moralis.'] == 'Summe', 'Häufigkeit'].values
-    df['Anteil'] = df['Häufigkeit'] / sum
+        sub_counts = labels_per_moralization(corpus, label_type)
+        if len(sub_counts) > len(counts):
+            counts = np.pad(counts, (0, len(sub_counts) - len(counts)))
+        counts[:len(sub_counts)] += sub_counts
+
+    total = counts.sum()
+    df = pd.DataFrame({
+        'Label in einer Moralis.': list(range(len(counts))) + ['Summe'],
+        'Häufigkeit': np.append(counts, total)
+    })
+    df['Anteil'] = df['Häufigkeit'] / total
 
     if plot:
         df_nosum = df[df['Label in einer Moralis.'] != 'Summe']
@@ -471,43 +413,14 @@ def roles_and_groups_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df_list = []
-    for corpus in corpus_collection.collection.values():
-        sub_df = la.roles_groups_table(corpus.protagonists,
-                                       corpus_collection.language)
-        df_list.append(sub_df)
-
-    df_full = {
-            'Kategorie': [
-                "Individuum",
-                "Institution",
-                "Menschen",
-                "soziale Gruppe",
-                "Sonstige"
-            ],
-            'Adresassat:in': [
-                0, 0, 0, 0, 0
-            ],
-            'Benefizient:in': [
-                0, 0, 0, 0, 0
-            ],
-            'Forderer:in': [
-                0, 0, 0, 0, 0
-            ],
-            'Kein Bezug': [
-                0, 0, 0, 0, 0
-            ],
-            'Malefizient:in': [
-                0, 0, 0, 0, 0
-            ],
-            'Bezug unklar': [
-                0, 0, 0, 0, 0
-            ]
-        }
-    df_full = pd.DataFrame(df_full)
-
-    for df in df_list:
-        df_full.iloc[:, 1:] += df.iloc[:, 1:]
+    roles = xau.possible_labels('prot_roles')
+    counts = corpus_collection.label_pair_counts(
+        'protagonists',
+        'Gruppe', PROTAGONIST_GROUPS,
+        'Rolle', roles
+    )
+    df_full = pd.DataFrame(counts, columns=roles)
+    df_full.insert(0, 'Kategorie', GROUP_NAMES)
 
     if corpus_collection.language.lower() == 'de':
         df_full.drop('Malefizient:in', axis=1, inplace=True)
@@ -521,43 +434,8 @@ def roles_and_groups_collection(corpus_collection,
         df_full.drop('Kein Bezug', axis=1, inplace=True)
 
     if relative:
-        if corpus_collection.language.lower() == 'de':
-            df_full[['Adresassat:in',
-                     'Benefizient:in',
-                     'Forderer:in',
-                     'Kein Bezug'
-                     ]] \
-                = df_full[['Adresassat:in',
-                           'Benefizient:in',
-                           'Forderer:in',
-                           'Kein Bezug'
-                           ]].apply(lambda x: x / x.sum())
-        elif corpus_collection.language.lower() != 'all':
-            df_full[['Adresassat:in',
-                     'Benefizient:in',
-                     'Forderer:in',
-                     'Malefizient:in',
-                     'Bezug unklar'
-                     ]] \
-                = df_full[['Adresassat:in',
-                           'Benefizient:in',
-                           'Forderer:in',
-                           'Malefizient:in',
-                           'Bezug unklar'
-                           ]].apply(lambda x: x / x.sum())
-        else:
-            df_full[['Adresassat:in',
-                     'Benefizient:in',
-                     'Forderer:in',
-                     'Malefizient:in',
-                     'Bezug unklar/kein Bezug'
-                     ]] \
-                = df_full[['Adresassat:in',
-                           'Benefizient:in',
-                           'Forderer:in',
-                           'Malefizient:in',
-                           'Bezug unklar/kein Bezug'
-                           ]].apply(lambda x: x / x.sum())
+        columns = df_full.columns[1:]
+        df_full[columns] = df_full[columns].apply(lambda x: x / x.sum())
 
     if export:
         df_full.to_csv("roles_and_groups_collection.csv",
@@ -583,24 +461,17 @@ def groups_and_ownother_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df_list = []
-    for corpus in corpus_collection.collection.values():
-        sub_df = la.groups_ownother_table(corpus.protagonists)
-        df_list.append(sub_df)
-
-    df = df_list[0]
-    for i in range(0, len(df_list)-1):
-        df.iloc[:, 1:] += df_list[i + 1].iloc[:, 1:]
+    own_other = xau.possible_labels('prot_ownother')
+    counts = corpus_collection.label_pair_counts(
+        'protagonists',
+        'Gruppe', PROTAGONIST_GROUPS,
+        'own/other', own_other
+    )
+    df = pd.DataFrame(counts, columns=own_other)
+    df.insert(0, 'Kategorie', GROUP_NAMES)
 
     if relative:
-        df[['Own Group',
-            'Other Group',
-            'Neutral',
-            ]] \
-            = df[['Own Group',
-                  'Other Group',
-                  'Neutral',
-                  ]].apply(lambda x: x / x.sum())
+        df[own_other] = df[own_other].apply(lambda x: x / x.sum())
 
     if export:
         df.to_csv("groups_and_ownother.csv", index=False, decimal=',')
@@ -625,25 +496,26 @@ def roles_and_ownother_collection(corpus_collection,
         - Pandas dataframe as described above.
     """
 
-    df_list = []
-    for corpus in corpus_collection.collection.values():
-        sub_df = la.roles_ownother_table(corpus.protagonists,
-                                         language=corpus_collection.language)
-        df_list.append(sub_df)
-
-    df = df_list[0]
-    for i in range(0, len(df_list)-1):
-        df.iloc[:, 1:] += df_list[i + 1].iloc[:, 1:]
+    roles = xau.possible_labels('prot_roles')
+    own_other = xau.possible_labels('prot_ownother')
+    counts = corpus_collection.label_pair_counts(
+        'protagonists',
+        'Rolle', roles,
+        'own/other', own_other
+    )
+    df = pd.DataFrame(counts, columns=own_other)
+    df.insert(0, 'Kategorie', roles)
+
+    # Roles that are not annotated in the language, as in
+    # la.roles_ownother_table()
+    if corpus_collection.language.lower() == 'de':
+        df.drop([3, 5], axis=0, inplace=True)
+    elif corpus_collection.language.lower() != 'all':
+        df.drop(4, axis=0, inplace=True)
+    df.reset_index(drop=True, inplace=True)
 
     if relative:
-        df[['Own Group',
-            'Other Group',
-            'Neutral',
-            ]] \
-            = df[['Own Group',
-                  'Other Group',
-                  'Neutral',
-                  ]].apply(lambda x: x / x.sum())
+        df[own_other] = df[own_other].apply(lambda x: x / x.sum())
 
     if export:
         df.to_csv("roles_and_ownother.csv", index=False, decimal=',')
@@ -687,55 +559,28 @@ def association_measure_collection(corpus_collection,
         print("Note: It might be better to use roles_and_groups(),"
               " roles_and_ownother() or groups_and_ownother() here!")
 
-    tables_df = pd.DataFrame(index=xau.possible_labels(cat1),
-                             columns=xau.possible_labels(cat2))
-    for row_label in tables_df.index:
-        for col_label in tables_df.columns:
-            tables_df.loc[row_label, col_label] = [[0, 0], [0, 0]]
+    # Contingency tables of all corpora, summed up
+    cube = sum(la.table_cube(corpus, cat1, cat2)
+               for corpus in corpus_collection.collection.values())
 
-    for corpus in corpus_collection.collection.values():
-        sub_df = la.table_table(corpus, cat1, cat2)
-        for row_label in tables_df.index:
-            # Iterate over column labels
-            for col_label in tables_df.columns:
-                # Get the value from the original_df
-                original_value = tables_df.loc[row_label, col_label]
-
-                # Get the value from the additional_df
-                additional_value = sub_df.loc[row_label, col_label]
-
-                # Perform the addition and update the value in the original_df
-                tables_df.loc[row_label, col_label] = [
-                    [original_value[0][0] + additional_value[0][0],
-                     original_value[0][1] + additional_value[0][1]],
-                    [original_value[1][0] + additional_value[1][0],
-                     original_value[1][1] + additional_value[1][1]]
-                ]
+    labels1 = xau.possible_labels(cat1)
+    labels2 = xau.possible_labels(cat2)
+    pmi_norm = xau.normalized_pmi_batch(cube)
 
     if significance:
-        columns = pd.MultiIndex.from_product([xau.possible_labels(cat2),
+        fisher_sig = xau.fisher_exact_batch(cube)
+        columns = pd.MultiIndex.from_product([labels2,
                                              ['Significance', 'PMI']])
-        am_df = pd.DataFrame(index=xau.possible_labels(cat1),
-                             columns=columns)
-        for row_label in am_df.index:
-            for col_label in xau.possible_labels(cat2):
-
-                table = tables_df.loc[row_label, col_label]
-
-                fisher_sig = stats.fisher_exact(table).pvalue
-                pmi_norm = xau.calculate_normalized_pmi(table)
-
-                am_df.loc[row_label, (col_label, 'Significance')] = fisher_sig
-                am_df.loc[row_label, (col_label, 'PMI')] = pmi_norm
+        # Interleave the two grids column by column
+        am_df = pd.DataFrame(
+            np.stack([fisher_sig, pmi_norm], axis=-1).reshape(
+                len(labels1), -1),
+            index=labels1,
+            columns=columns
+        )
 
     else:
-        am_df = tables_df
-        for row_label in am_df.index:
-            for col_label in xau.possible_labels(cat2):
-                table = tables_df.loc[row_label, col_label]
-
-                pmi_norm = xau.calculate_normalized_pmi(table)
-                am_df.loc[row_label, col_label] = pmi_norm
+        am_df = pd.DataFrame(pmi_norm, index=labels1, columns=labels2)
 
     if export:
         am_df.to_csv("association.csv", index=False, decimal=',')
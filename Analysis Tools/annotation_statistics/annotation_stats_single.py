@@ -1,9 +1,9 @@
 import sys
 import label_analysis as la
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-import scipy.stats as stats
 
 sys.path.append("../_utils_")
 import xmi_analysis_util as xau
@@ -42,56 +42,40 @@ def moral_values_freq(corpus,
         print("Error: Moral_type parameter must be 'all', 'obj', or 'subj'.")
         return
 
-    df = {
-        'Moralwert': [
-            'Care',
-            'Harm',
-            'Fairness',
-            'Cheating',
-            'Loyalty',
-            'Betrayal',
-            'Authority',
-            'Subversion',
-            'Sanctity',
-            'Degradation',
-            'Liberty',
-            'Oppression',
+    labels = [
+        'Care',
+        'Harm',
+        'Fairness',
+        'Cheating',
+        'Loyalty',
+        'Betrayal',
+        'Authority',
+        'Subversion',
+        'Sanctity',
+        'Degradation',
+        'Liberty',
+        'Oppression',
+        'OTHER'
+    ]
+    counts = xau.count_labels(value_list, 'Category', labels)
+
+    if sum_dimensions:
+        labels = [
+            'Care/harm',
+            'Fairness/cheating',
+            'Loyalty/betrayal',
+            'Authority/subversion',
+            'Sanctity/degradation',
+            'Liberty/oppression',
             'OTHER'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0, 0,
-            0, 0, 0, 0, 0, 0
         ]
-    }
-    df = pd.DataFrame(df)
-    for value in value_list:
-        if value['Category'] in df['Moralwert'].values:
-            df.loc[df['Moralwert'] == value['Category'], 'Vorkommen'] += 1
+        # Add up the two sides of each dimension
+        counts = np.append(counts[:12].reshape(6, 2).sum(axis=1), counts[12])
 
-    if sum_dimensions:
-        temp_df = {
-            'Moralwert': [
-                'Care/harm',
-                'Fairness/cheating',
-                'Loyalty/betrayal',
-                'Authority/subversion',
-                'Sanctity/degradation',
-                'Liberty/oppression',
-                'OTHER'
-            ],
-            'Vorkommen': [
-                0, 0, 0, 0, 0, 0, 0
-            ]
-        }
-        temp_df = pd.DataFrame(temp_df)
-        for i in range(0, 6):
-            temp_df.loc[i, 'Vorkommen'] = (
-                df.loc[i*2]['Vorkommen']
-                + df.loc[i*2 + 1]['Vorkommen']
-            )
-        temp_df.loc[6, 'Vorkommen'] = df.loc[12, 'Vorkommen']
-
-        df = temp_df
+    df = pd.DataFrame({
+        'Moralwert': labels,
+        'Vorkommen': counts
+    })
 
     total = df['Vorkommen'].sum()
     df['Anteil'] = df['Vorkommen'] / total
@@ -144,17 +128,13 @@ def protagonist_role_freq(corpus,
             'Malefizient:in',
             'Bezug unklar',
             'Kein Bezug'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0
         ]
     }
+    df['Vorkommen'] = xau.count_labels(corpus.protagonists_doubles,
+                                       'Rolle',
+                                       df['Rolle'])
     df = pd.DataFrame(df)
 
-    for protagonist in corpus.protagonists_doubles:
-        if protagonist['Rolle'] in df['Rolle'].values:
-            df.loc[df['Rolle'] == protagonist['Rolle'], 'Vorkommen'] += 1
-
     total = df['Vorkommen'].sum()
     df['Anteil'] = df['Vorkommen'] / total
 
@@ -210,17 +190,13 @@ def protagonist_group_freq(corpus,
             'Menschen',
             'soziale Gruppe',
             'OTHER'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0
         ]
     }
+    df['Vorkommen'] = xau.count_labels(corpus.protagonists,
+                                       'Gruppe',
+                                       df['Gruppe'])
     df = pd.DataFrame(df)
 
-    for protagonist in corpus.protagonists:
-        if protagonist['Gruppe'] in df['Gruppe'].values:
-            df.loc[df['Gruppe'] == protagonist['Gruppe'], 'Vorkommen'] += 1
-
     total = df['Vorkommen'].sum()
     df['Anteil'] = df['Vorkommen'] / total
 
@@ -267,19 +243,13 @@ def protagonist_ownother_freq(corpus,
             'Own Group',
             'Other Group',
             'Neutral',
-        ],
-        'Vorkommen': [
-            0, 0, 0
         ]
     }
+    df['Vorkommen'] = xau.count_labels(corpus.protagonists,
+                                       'own/other',
+                                       df['Own/Other'])
     df = pd.DataFrame(df)
 
-    for protagonist in corpus.protagonists:
-        if protagonist['own/other'] in df['Own/Other'].values:
-            df.loc[
-                df['Own/Other'] == protagonist['own/other'], 'Vorkommen'
-            ] += 1
-
     total = df['Vorkommen'].sum()
     df['Anteil'] = (df['Vorkommen'] / total)
 
@@ -330,17 +300,12 @@ def comfunction_freq(corpus,
             'Appell+Beziehung',
             'Appell+Darstellung',
             'Appell+Expression'
-        ],
-        'Vorkommen': [
-            0, 0, 0, 0, 0, 0, 0
         ]
     }
+    df['Vorkommen'] = xau.count_labels(corpus.com_functions,
+                                       'Category',
+                                       df['Kommunikative Funktion'])
     df = pd.DataFrame(df)
-    for func in corpus.com_functions:
-        if func['Category'] in df['Kommunikative Funktion'].values:
-            df.loc[
-                df['Kommunikative Funktion'] == func['Category'],
-                'Vorkommen'] += 1
 
     total = df['Vorkommen'].sum()
     df['Anteil'] = df['Vorkommen'] / total
@@ -645,32 +610,26 @@ def association_measure(corpus,
     if (cat1 in cat_possibilities[3:6] and cat2 in cat_possibilities[3:6]):
         print("It is better to use ------ here!")
 
-    tables_df = la.table_table(corpus, cat1, cat2)
+    cube = la.table_cube(corpus, cat1, cat2)
+
+    labels1 = xau.possible_labels(cat1)
+    labels2 = xau.possible_labels(cat2)
+    pmi_norm = xau.normalized_pmi_batch(cube)
 
     if significance:
-        columns = pd.MultiIndex.from_product([xau.possible_labels(cat2),
+        fisher_sig = xau.fisher_exact_batch(cube)
+        columns = pd.MultiIndex.from_product([labels2,
                                              ['Sig', 'PMI']])
-        am_df = pd.DataFrame(index=xau.possible_labels(cat1),
-                             columns=columns)
-        for row_label in am_df.index:
-            for col_label in xau.possible_labels(cat2):
-
-                table = tables_df.loc[row_label, col_label]
-
-                fisher_sig = stats.fisher_exact(table).pvalue
-                pmi_norm = xau.calculate_normalized_pmi(table)
-
-                am_df.loc[row_label, (col_label, 'Sig')] = fisher_sig
-                am_df.loc[row_label, (col_label, 'PMI')] = pmi_norm
+        # Interleave the two grids column by column
+        am_df = pd.DataFrame(
+            np.stack([fisher_sig, pmi_norm], axis=-1).reshape(
+                len(labels1), -1),
+            index=labels1,
+            columns=columns
+        )
 
     else:
-        am_df = tables_df
-        for row_label in am_df.index:
-            for col_label in xau.possible_labels(cat2):
-                table = tables_df.loc[row_label, col_label]
-
-                pmi_norm = xau.calculate_normalized_pmi(table)
-                am_df.loc[row_label, col_label] = pmi_norm
+        am_df = pd.DataFrame(pmi_norm, index=labels1, columns=labels2)
 
     if export:
         am_df.to_csv("association.csv", index=False, decimal=',')
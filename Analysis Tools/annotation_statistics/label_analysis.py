@@ -49,9 +49,10 @@ def label_freq_table(moral_spans_list, protagonist_spans_list):
     moralizations_dict = {}
     for moralization in moral_spans_list:
         moralizations_dict[moralization] = 0
+    moral_index = xau.SpanIndex(moral_spans_list)
     for protagonist in protagonist_spans_list:
         moral_span = xau.inside_of(
-            moral_spans_list, protagonist["Coordinates"])
+            moral_index, protagonist["Coordinates"])
         if moral_span:
             moralizations_dict[moral_span] += 1
 
@@ -238,7 +239,11 @@ def roles_ownother_table(protagonists, language='all'):
     return df
 
 
-def table_table(corpus, cat1, cat2):
+def category_layer(cat):
+    """
+    Returns the name of the CorpusData attribute that holds the
+    annotations of an annotation category such as 'prot_roles'.
+    """
     cat_possibilities = ['obj_morals', 'subj_morals', 'all_morals',
                          'prot_roles', 'prot_groups', 'prot_ownother',
                          'com_functions',
@@ -248,28 +253,45 @@ def table_table(corpus, cat1, cat2):
                  'com_functions',
                  'all_demands']
 
-    cat1_trans = cat_trans[cat_possibilities.index(cat1)]
-    cat2_trans = cat_trans[cat_possibilities.index(cat2)]
+    return cat_trans[cat_possibilities.index(cat)]
 
-    df_tables = pd.DataFrame(index=xau.possible_labels(cat1),
-                             columns=xau.possible_labels(cat2))
 
-    associations1 = xau.label_associations_category(
-        corpus.moralizations,
-        getattr(corpus, cat1_trans)
-    )
-    associations2 = xau.label_associations_category(
-        corpus.moralizations,
-        getattr(corpus, cat2_trans)
+def presence_matrix(corpus, cat):
+    """
+    Creates a boolean matrix that shows which labels of an annotation
+    category (such as 'all_morals' or 'prot_roles') are present in
+    every moralization of a CorpusData object; see xau.presence_matrix().
+    The rows follow corpus.moralizations,
+    the columns xau.possible_labels(cat).
+    """
+    return corpus.presence_matrix(category_layer(cat),
+                                  xau.possible_labels(cat))
+
+
+def table_cube(corpus, cat1, cat2):
+    """
+    Returns the contingency tables of all label pairs of two annotation
+    categories as an integer array of shape (labels1, labels2, 2, 2);
+    see xau.contingency_cube(). The array is cached in the corpus.
+    """
+    return corpus.cached(
+        ("contingency_cube", cat1, cat2),
+        ("moralizations", category_layer(cat1), category_layer(cat2)),
+        lambda: xau.contingency_cube(presence_matrix(corpus, cat1),
+                                     presence_matrix(corpus, cat2))
     )
 
-    for row_label in df_tables.index:
-        for col_label in xau.possible_labels(cat2):
-            table = xau.freq_table(corpus,
-                                   associations1,
-                                   associations2,
-                                   row_label,
-                                   col_label)
-            df_tables.loc[row_label, col_label] = table
+
+def table_table(corpus, cat1, cat2):
+    """
+    For two annotation categories, creates a dataframe with the
+    contingency table (see xau.freq_table()) of every label pair,
+    in the form of nested lists.
+    """
+    cube = table_cube(corpus, cat1, cat2)
+
+    df_tables = pd.DataFrame(cube.tolist(),
+                             index=xau.possible_labels(cat1),
+                             columns=xau.possible_labels(cat2))
 
     return df_tables
@@ -1,17 +1,19 @@
+import os
 import sys
 import nltk
-import spacy
 import pandas as pd
-from HanTa import HanoverTagger as ht
 
 sys.path.append('../_utils_')
+import dimi_matcher as dm
+import token_store as ts
 import xmi_analysis_util as xau
 
 
 def tokens_in_annotations(
         label_type,
         language,
-        corpus
+        corpus,
+        store=None
 ):
     if not xau.valid_category(label_type):
         return
@@ -21,8 +23,12 @@ def tokens_in_annotations(
     token_dict = {}
 
     for instance in label:
-        text = xau.get_span(corpus.text, instance['Coordinates'])
-        tokenized = nltk.tokenize.word_tokenize(text, language=language)
+        if store is not None:
+            tokenized = [tag[0] for tag in store.tokens(
+                instance['Coordinates'])]
+        else:
+            text = xau.get_span(corpus.text, instance['Coordinates'])
+            tokenized = nltk.tokenize.word_tokenize(text, language=language)
         tokenized = [word.lower() for word in tokenized]
 
         for token in tokenized:
@@ -38,106 +44,30 @@ def tokens_in_annotations(
     return token_dict
 
 
-def find_phrase_position_hanta(sentence, phrase):
-    for i in range(len(sentence)):
-        if sentence[i:i + len(phrase)] == phrase:
-            return i
-
-    return -1
-
-
-def find_phrase_position_spacy(sentence, phrase):
-    phrase_tokens = [token.text for token in phrase]
-
-    for i in range(len(sentence) - len(phrase_tokens) + 1):
-        ngram = [token.text for token in sentence[i:i + len(phrase_tokens)]]
-        if ngram == phrase_tokens:
-            return i
-
-    return -1
-
-
 def lemmata_in_annotations(
         label_type,
         language,
         corpus,
-        hanta=False
+        hanta=False,
+        batch_size=None,
+        n_process=1,
+        store=None
 ):
     if not xau.valid_category(label_type):
         return
 
-    label = getattr(corpus, label_type)
-    association = xau.label_associations_category(
-        corpus.moralizations,
-        label
-    )
+    association = corpus.associations(label_type)
 
     lemma_dict = {}
 
-    if (language == "de" or language == "en") and hanta:
-
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, moralization),
-                    language=language
-                )
-                tokenized_instance = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, instance['Coordinates']),
-                    language=language
-                )
-
-                instance_position = find_phrase_position_hanta(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                tags = tagger.tag_sent(tokenized_sent)
-
-                relevant_tokens = tags[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag[1] not in lemma_dict:
-                        lemma_dict[tag[1]] = 1
-                    else:
-                        lemma_dict[tag[1]] += 1
-
-    else:
-
-        model = spacy.load(f'{language}_core_news_md')
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = model(
-                    xau.get_span(corpus.text, moralization)
-                )
-                tokenized_instance = model(
-                    xau.get_span(corpus.text, instance['Coordinates'])
-                )
-
-                instance_position = find_phrase_position_spacy(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                relevant_tokens = tokenized_instance[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag.lemma_ not in lemma_dict:
-                        lemma_dict[tag.lemma_] = 1
-                    else:
-                        lemma_dict[tag.lemma_] += 1
+    for moralization, instance, span_store in ts.moralization_instances(
+            corpus, association, language, hanta, batch_size, n_process,
+            store, attributes=('lemma',)):
+        for tag in span_store.tokens(instance['Coordinates']):
+            if tag[1] not in lemma_dict:
+                lemma_dict[tag[1]] = 1
+            else:
+                lemma_dict[tag[1]] += 1
 
     # Sort dictionary by values
     lemma_dict = {k: v for k, v in sorted(lemma_dict.items(),
@@ -151,83 +81,27 @@ def pos_in_annotations(
         label_type,
         language,
         corpus,
-        hanta=False
+        hanta=False,
+        batch_size=None,
+        n_process=1,
+        store=None
 ):
     if not xau.valid_category(label_type):
         return
 
-    label = getattr(corpus, label_type)
-    association = xau.label_associations_category(
-        corpus.moralizations,
-        label
-    )
+    association = corpus.associations(label_type)
 
     lemma_dict = {}
 
-    if (language == "de" or language == "en") and hanta:
-
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, moralization),
-                    language=language
-                )
-                tokenized_instance = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, instance['Coordinates']),
-                    language=language
-                )
-                instance_position = find_phrase_position_hanta(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                tags = tagger.tag_sent(tokenized_sent)
-
-                relevant_tokens = tags[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag[2] in pos_list:
-                        if tag[1] not in lemma_dict:
-                            lemma_dict[tag[1]] = 1
-                        else:
-                            lemma_dict[tag[1]] += 1
-
-    else:
-
-        model = spacy.load(f'{language}_core_news_md')
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = model(
-                    xau.get_span(corpus.text, moralization)
-                )
-                tokenized_instance = model(
-                    xau.get_span(corpus.text, instance['Coordinates'])
-                )
-                instance_position = find_phrase_position_spacy(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                relevant_tokens = tokenized_instance[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag.pos_ in pos_list:
-                        if tag.lemma_ not in lemma_dict:
-                            lemma_dict[tag.lemma_] = 1
-                        else:
-                            lemma_dict[tag.lemma_] += 1
+    for moralization, instance, span_store in ts.moralization_instances(
+            corpus, association, language, hanta, batch_size, n_process,
+            store):
+        for tag in span_store.tokens(instance['Coordinates']):
+            if tag[2] in pos_list:
+                if tag[1] not in lemma_dict:
+                    lemma_dict[tag[1]] = 1
+                else:
+                    lemma_dict[tag[1]] += 1
 
     # Sort dictionary by values
     lemma_dict = {k: v for k, v in sorted(lemma_dict.items(),
@@ -246,21 +120,32 @@ def get_comparison_list(
     """
     Mostly depricated. Uses files as input that cannot be generated with
     the current code. Use tokens_in_annotation() and list comprehension instead
+
+    The sheets of DiMi workbooks (see dimi_matcher.py) are taken from the
+    compiled DiMi lexicon instead; header is ignored for them, as their
+    sheets have no header row.
     """
 
-    comparison_list = []
-    df_protag = pd.read_excel(
-        filename, sheet_name=comparison_sheet, header=header)
+    dictionary = dimi_dictionary(filename, comparison_sheet)
+    if dictionary is not None:
+        comparison_list = dimi_sheet_list(filename, *dictionary)
+        if top_hits != 0:
+            comparison_list = comparison_list[:top_hits]
 
-    # Use all entries in the list if no maximum was set
-    if top_hits == 0:
-        top_hits = len(df_protag)
+    else:
+        comparison_list = []
+        df_protag = pd.read_excel(
+            filename, sheet_name=comparison_sheet, header=header)
 
-    # Add all relevant Lemmas to the list that will get compared
-    for index, row in df_protag.iterrows():
-        if index < top_hits:
-            if not row[1] == -1:
-                comparison_list.append(row[0])
+        # Use all entries in the list if no maximum was set
+        if top_hits == 0:
+            top_hits = len(df_protag)
+
+        # Add all relevant Lemmas to the list that will get compared
+        for index, row in df_protag.iterrows():
+            if index < top_hits:
+                if not row[1] == -1:
+                    comparison_list.append(row[0])
 
     # Remove unwanted entries from list
     if dont_count_list:
@@ -271,88 +156,58 @@ def get_comparison_list(
     return comparison_list
 
 
+def dimi_dictionary(filename, sheet):
+    """
+    Returns (language, version, polarity, selection) if filename is a
+    DiMi workbook and sheet one of its sheets, else None.
+    """
+    for (language, version), dimi_file in dm.DIMI_FILES.items():
+        if os.path.basename(filename) == dimi_file:
+            if sheet.lower() in dm.DIMI_SHEETS:
+                return (language, version) + dm.DIMI_SHEETS[sheet.lower()]
+            return None
+
+    return None
+
+
+def dimi_sheet_list(filename, language, version, polarity, selection):
+    """
+    Returns the unique entries of one sheet of a DiMi workbook in their
+    order, read with dm.dimi_entries() from the directory of filename.
+    """
+    entries = {}
+    for entry, entry_polarity, entry_selection in dm.dimi_entries(
+            language, version, os.path.dirname(os.path.abspath(filename))):
+        if (entry_polarity, entry_selection) == (polarity, selection):
+            entries[entry] = None
+
+    return list(entries)
+
+
 def lemmata_with_annotations(
         label_type,
         language,
         corpus,
-        hanta=False
+        hanta=False,
+        batch_size=None,
+        n_process=1,
+        store=None
 ):
     if not xau.valid_category(label_type):
         return
 
-    label = getattr(corpus, label_type)
-    association = xau.label_associations_category(
-        corpus.moralizations,
-        label
-    )
+    association = corpus.associations(label_type)
 
     lemma_dict = {}
 
-    if (language == "de" or language == "en") and hanta:
-
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, moralization),
-                    language=language
-                )
-                tokenized_instance = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, instance['Coordinates']),
-                    language=language
-                )
-
-                instance_position = find_phrase_position_hanta(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                tags = tagger.tag_sent(tokenized_sent)
-
-                relevant_tokens = tags[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag[1] not in lemma_dict:
-                        lemma_dict[tag[1]] = [1, [instance]]
-                    else:
-                        lemma_dict[tag[1]][0] += 1
-                        lemma_dict[tag[1]][1].append(instance)
-
-    else:
-
-        model = spacy.load(f'{language}_core_news_md')
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized_sent = model(
-                    xau.get_span(corpus.text, moralization)
-                )
-                tokenized_instance = model(
-                    xau.get_span(corpus.text, instance['Coordinates'])
-                )
-
-                instance_position = find_phrase_position_spacy(
-                    tokenized_sent,
-                    tokenized_instance)
-
-                relevant_tokens = tokenized_instance[
-                    instance_position:
-                    len(tokenized_instance)+instance_position
-                ]
-
-                for tag in relevant_tokens:
-                    if tag.lemma_ not in lemma_dict:
-                        lemma_dict[tag.lemma_] = [1, [instance]]
-                    else:
-                        lemma_dict[tag.lemma_][0] += 1
-                        lemma_dict[tag.lemma_][1].append(instance)
+    for moralization, instance, span_store in ts.moralization_instances(
+            corpus, association, language, hanta, batch_size, n_process,
+            store, attributes=('lemma',)):
+        for tag in span_store.tokens(instance['Coordinates']):
+            if tag[1] not in lemma_dict:
+                lemma_dict[tag[1]] = [1, [instance]]
+            else:
+                lemma_dict[tag[1]][0] += 1
+                lemma_dict[tag[1]][1].append(instance)
 
     return lemma_dict
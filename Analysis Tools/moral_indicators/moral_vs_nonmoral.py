@@ -1,8 +1,19 @@
-from HanTa import HanoverTagger as ht
+import hashlib
+import sys
+from collections import Counter
+
 import nltk
-import scipy.stats as stats
+import numpy as np
+import pandas as pd
 import xlsxwriter
-import spacy
+
+sys.path.append('../_utils_')
+import nlp_models as nm
+import xmi_analysis_util as xau
+
+
+# Frequency profiles of text lists, see tag_profile() and token_profile()
+_profiles = {}
 
 
 def get_stats(
@@ -12,149 +23,280 @@ def get_stats(
         counter_them_n
 ):
 
-    try:
-        likelihood_moral = counter_moral_prot / counter_moral_n
-        likelihood_them = counter_them_prot / counter_them_n
-
-        not_prot_moral = counter_moral_n - counter_moral_prot
-        not_prot_them = counter_them_n - counter_them_prot
+    table = get_stats_table(
+        ["term"],
+        [counter_moral_prot],
+        counter_moral_n,
+        [counter_them_prot],
+        counter_them_n
+    )
 
-        contingency_table = [
-            [counter_moral_prot, not_prot_moral],
-            [counter_them_prot, not_prot_them]
-        ]
+    return stats_dict(table, counter_moral_n, counter_them_n)["term"]
 
-        res = stats.fisher_exact(contingency_table)
 
-        ratio = (
-            likelihood_moral
-            / likelihood_them
-        )
+def get_stats_table(
+        terms,
+        moral_counts,
+        moral_n,
+        nonmoral_counts,
+        nonmoral_n
+):
+    """
+    Compares the frequencies of any number of terms in moralizing
+    and non-moralizing segments at once.
+
+    Parameters:
+        terms: list of N terms (lemmata, POS tags or tokens)
+        moral_counts: N counts of the terms in the moralizing segments
+        moral_n: number of tokens in the moralizing segments
+        nonmoral_counts: N counts in the non-moralizing segments
+        nonmoral_n: number of tokens in the non-moralizing segments
+    Returns:
+        DataFrame with one row per term. Besides the counts, it contains
+        the likelihoods, their ratio, log-ratio and difference
+        coefficient, the p-value of Fisher's exact test and the p-value
+        corrected for multiple testing (Benjamini-Hochberg). Zero counts
+        never raise an error: undefined ratios are inf or NaN.
+    """
+    moral_counts = np.asarray(moral_counts, dtype=np.int64)
+    nonmoral_counts = np.asarray(nonmoral_counts, dtype=np.int64)
+
+    tables = np.stack((
+        np.stack((moral_counts, moral_n - moral_counts), axis=-1),
+        np.stack((nonmoral_counts, nonmoral_n - nonmoral_counts), axis=-1)
+    ), axis=-2)
+    pvalues = xau.fisher_exact_batch(tables)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        likelihood_moral = moral_counts / np.float64(moral_n)
+        likelihood_them = nonmoral_counts / np.float64(nonmoral_n)
+        ratio = likelihood_moral / likelihood_them
         diff_coeficient = (
             (likelihood_moral - likelihood_them)
             / (likelihood_moral + likelihood_them)
         )
+        # Binary log of the ratio; zero counts are replaced by 0.5
+        log_ratio = np.log2(
+            (np.where(moral_counts == 0, 0.5, moral_counts) / moral_n)
+            / (np.where(nonmoral_counts == 0, 0.5, nonmoral_counts)
+               / nonmoral_n)
+        )
 
-        statistics = {
+    return pd.DataFrame(
+        {
+            "count_moral": moral_counts,
+            "count_nonmoral": nonmoral_counts,
             "likelihood_moral": likelihood_moral,
             "likelihood_nonmoral": likelihood_them,
             "ratio": ratio,
+            "log_ratio": log_ratio,
             "diff_coeficient": diff_coeficient,
-            "pvalue_fisher": res.pvalue,
-            "contingency_table": contingency_table
+            "pvalue_fisher": pvalues,
+            "pvalue_fisher_bh": xau.benjamini_hochberg(pvalues)
+        },
+        index=list(terms)
+    )
+
+
+def stats_dict(table, moral_n, nonmoral_n):
+    """
+    Converts a table from get_stats_table() into a dictionary with one
+    statistics dictionary per term, as written by dict_to_xlsx().
+    """
+    results_dict = {}
+    for term, row in zip(table.index, table.itertuples(index=False)):
+        count_moral = int(row.count_moral)
+        count_nonmoral = int(row.count_nonmoral)
+        results_dict[term] = {
+            "likelihood_moral": float(row.likelihood_moral),
+            "likelihood_nonmoral": float(row.likelihood_nonmoral),
+            "ratio": float(row.ratio),
+            "diff_coeficient": float(row.diff_coeficient),
+            "pvalue_fisher": float(row.pvalue_fisher),
+            "pvalue_fisher_bh": float(row.pvalue_fisher_bh),
+            "contingency_table": [
+                [count_moral, moral_n - count_moral],
+                [count_nonmoral, nonmoral_n - count_nonmoral]
+            ]
         }
 
-        return statistics
+    return results_dict
+
 
-    except ZeroDivisionError:
-        print("Error: Division by zero.")
-        return None
+def compare_likelihood_table(moral_counts, nonmoral_counts, term_list):
+    """
+    Takes two comparison dictionaries as returned by the
+    count_instances_* functions (not in combined mode) and
+    returns get_stats_table() for all terms of term_list.
+    """
+    return get_stats_table(
+        term_list,
+        [moral_counts[term] for term in term_list],
+        moral_counts["_total_"],
+        [nonmoral_counts[term] for term in term_list],
+        nonmoral_counts["_total_"]
+    )
 
 
-def count_instances_lemma(
+def text_list_key(text_list):
+    """Returns a hash that identifies the content of a list of strings."""
+    sha = hashlib.sha1()
+    for doc in text_list:
+        sha.update(doc.encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def clear_profiles():
+    """Drops all memoized frequency profiles."""
+    _profiles.clear()
+
+
+def tag_profile(
     text_list,
-    lemmata_list,
-    combined_mode,
     language='de',
-    hanta=False
+    hanta=False,
+    batch_size=None,
+    n_process=1,
+    attributes=('lemma', 'pos')
 ):
+    """
+    Tags a list of strings once and counts every lemma and/or POS tag.
+    The profile is memoized by the content of the list, so querying
+    the same list with other term lists does not tag it again.
+    With spaCy, only the components needed for attributes are loaded
+    (see nm.required_pipes()); HanTa always yields both.
+
+    Returns:
+        Dictionary with a Counter for each of attributes,
+        and the number of tokens as '_total_'.
+    """
+    hanta = (language == "de" or language == "en") and hanta
+    attributes = tuple(sorted(set(attributes)))
+    key = ('tags', text_list_key(text_list), hanta, language, attributes)
+    if key in _profiles:
+        return _profiles[key]
 
-    comparison_dict = {lemma: 0 for lemma in lemmata_list}
-    comparison_dict["_total_"] = 0
+    counters = {attribute: Counter() for attribute in attributes}
+    total = 0
 
-    if (language == "de" or language == "en") and hanta:
+    if hanta:
 
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
+        tagger = nm.hanta_tagger(language)
+        nltk_language = nm.NLTK_LANGUAGES[language]
 
         # Loop through the rows in the dataframe of moralizing segments
         for doc in text_list:
             doc = doc.replace('#', '')  # Data may contain '#' for highlighting
             tokenized_sents = nltk.tokenize.word_tokenize(
-                doc, language=language)
+                doc, language=nltk_language)
             tags = tagger.tag_sent(tokenized_sents)
-            for tag in tags:
-                comparison_dict["_total_"] += 1
-                if tag[1] in comparison_dict.keys():
-                    comparison_dict[tag[1]] += 1
+            if 'lemma' in counters:
+                counters['lemma'].update(tag[1] for tag in tags)
+            if 'pos' in counters:
+                counters['pos'].update(tag[2] for tag in tags)
+            total += len(tags)
 
     else:
 
-        model = spacy.load(f'{language}_core_news_md')
+        model = nm.spacy_model(language, attributes=attributes)
 
-        for doc in text_list:
-            doc = doc.replace('#', '')  # Data may contain '#' for highlighting
-            tagged = model(doc)
-            for tag in tagged:
-                comparison_dict["_total_"] += 1
-                if tag.lemma_ in comparison_dict.keys():
-                    comparison_dict[tag.lemma_] += 1
+        # Data may contain '#' for highlighting
+        docs = (doc.replace('#', '') for doc in text_list)
+        for tagged in model.pipe(
+                docs, batch_size=batch_size, n_process=n_process):
+            if 'lemma' in counters:
+                counters['lemma'].update(tag.lemma_ for tag in tagged)
+            if 'pos' in counters:
+                counters['pos'].update(tag.pos_ for tag in tagged)
+            total += len(tagged)
+
+    profile = dict(counters, _total_=total)
+    _profiles[key] = profile
+
+    return profile
+
+
+def token_profile(text_list, language='german'):
+    """
+    Tokenizes a list of strings once and counts every lower-cased token.
+    Memoized like tag_profile().
+
+    Returns:
+        Dictionary with a Counter for 'token' and the number
+        of tokens as '_total_'.
+    """
+    key = ('tokens', text_list_key(text_list), language)
+    if key in _profiles:
+        return _profiles[key]
+
+    tokens = Counter()
+    for doc in text_list:
+        doc = doc.replace('#', '')  # Data may contain '#' for highlighting
+        tokenized_sents = nltk.tokenize.word_tokenize(
+            doc, language=language)
+        tokens.update(word.lower() for word in tokenized_sents)
+
+    profile = {
+        'token': tokens,
+        '_total_': sum(tokens.values())
+    }
+    _profiles[key] = profile
+
+    return profile
+
+
+def query_profile(counts, total, term_list, combined_mode):
+    """
+    Looks up the terms of term_list in a Counter of a frequency profile.
+    Returns a dictionary with the count of every term and the number of
+    tokens as '_total_'; in combined_mode, the counts of all terms are
+    summed up under the key tuple(term_list).
+    """
+    comparison_dict = {term: counts[term] for term in term_list}
 
     if combined_mode:
-        combined_dict = {
-            "_total_": comparison_dict.pop("_total_")
+        return {
+            "_total_": total,
+            tuple(term_list): sum(comparison_dict.values())
         }
-        combined_dict[tuple(lemmata_list)] = sum(comparison_dict.values())
-        return combined_dict
 
+    comparison_dict["_total_"] = total
     return comparison_dict
 
 
-def count_instances_pos(
+def count_instances_lemma(
     text_list,
-    pos_list,
+    lemmata_list,
     combined_mode,
     language='de',
-    hanta=False
+    hanta=False,
+    batch_size=None,
+    n_process=1
 ):
 
-    comparison_dict = {pos: 0 for pos in pos_list}
-    comparison_dict["_total_"] = 0
-
-    if (language == "de" or language == "en") and hanta:
-
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
-
-        # Loop through the rows in the dataframe of moralizing segments
-        for doc in text_list:
-            doc = doc.replace('#', '')  # Data may contain '#' for highlighting
-            tokenized_sents = nltk.tokenize.word_tokenize(
-                doc, language=language)
-            tags = tagger.tag_sent(tokenized_sents)
-            for tag in tags:
-                comparison_dict["_total_"] += 1
-                if tag[2] in comparison_dict.keys():
-                    comparison_dict[tag[2]] += 1
+    profile = tag_profile(text_list, language, hanta, batch_size, n_process,
+                          attributes=('lemma',))
 
-    else:
+    return query_profile(profile['lemma'], profile['_total_'],
+                         lemmata_list, combined_mode)
 
-        model = spacy.load(f'{language}_core_news_md')
 
-        for doc in text_list:
-            doc = doc.replace('#', '')  # Data may contain '#' for highlighting
-            tagged = model(doc)
-            for tag in tagged:
-                comparison_dict["_total_"] += 1
-                if tag.pos_ in comparison_dict.keys():
-                    comparison_dict[tag.pos_] += 1
+def count_instances_pos(
+    text_list,
+    pos_list,
+    combined_mode,
+    language='de',
+    hanta=False,
+    batch_size=None,
+    n_process=1
+):
 
-    if combined_mode:
-        combined_dict = {
-            "_total_": comparison_dict.pop("_total_")
-        }
-        combined_dict[tuple(pos_list)] = sum(comparison_dict.values())
-        return combined_dict
+    profile = tag_profile(text_list, language, hanta, batch_size, n_process,
+                          attributes=('pos',))
 
-    return comparison_dict
+    return query_profile(profile['pos'], profile['_total_'],
+                         pos_list, combined_mode)
 
 
 def count_instances_token(
@@ -164,28 +306,10 @@ def count_instances_token(
     language='german',
 ):
 
-    comparison_dict = {token: 0 for token in token_list}
-    comparison_dict["_total_"] = 0
-
-    # Loop through the rows in the dataframe of moralizing segments
-    for doc in text_list:
-        doc = doc.replace('#', '')  # Data may contain '#' for highlighting
-        tokenized_sents = nltk.tokenize.word_tokenize(
-            doc, language=language)
-        lower_sents = [word.lower() for word in tokenized_sents]
-        for word in lower_sents:
-            comparison_dict["_total_"] += 1
-            if word in comparison_dict.keys():
-                comparison_dict[word] += 1
-
-    if combined_mode:
-        combined_dict = {
-            "_total_": comparison_dict.pop("_total_")
-        }
-        combined_dict[tuple(token_list)] = sum(comparison_dict.values())
-        return combined_dict
+    profile = token_profile(text_list, language)
 
-    return comparison_dict
+    return query_profile(profile['token'], profile['_total_'],
+                         token_list, combined_mode)
 
 
 def compare_lemma_likelihood(
@@ -332,16 +456,11 @@ def compare_lemma_likelihood_dict(
         hanta=hanta
     )
 
-    results_dict = {}
-    for lemma in lemmata:
-        results_dict[lemma] = get_stats(
-            moral_counts[lemma],
-            moral_counts["_total_"],
-            nonmoral_counts[lemma],
-            nonmoral_counts["_total_"]
-        )
+    table = compare_likelihood_table(moral_counts, nonmoral_counts, lemmata)
 
-    return results_dict
+    return stats_dict(table,
+                      moral_counts["_total_"],
+                      nonmoral_counts["_total_"])
 
 
 def compare_pos_likelihood_dict(
@@ -371,16 +490,11 @@ def compare_pos_likelihood_dict(
         hanta=hanta
     )
 
-    results_dict = {}
-    for pos in pos_list:
-        results_dict[pos] = get_stats(
-            moral_counts[pos],
-            moral_counts["_total_"],
-            nonmoral_counts[pos],
-            nonmoral_counts["_total_"]
-        )
+    table = compare_likelihood_table(moral_counts, nonmoral_counts, pos_list)
 
-    return results_dict
+    return stats_dict(table,
+                      moral_counts["_total_"],
+                      nonmoral_counts["_total_"])
 
 
 def compare_token_likelihood_dict(
@@ -407,16 +521,80 @@ def compare_token_likelihood_dict(
         language=language
     )
 
-    results_dict = {}
-    for token in token_list:
-        results_dict[token] = get_stats(
-            moral_counts[token],
-            moral_counts["_total_"],
-            nonmoral_counts[token],
-            nonmoral_counts["_total_"]
-        )
+    table = compare_likelihood_table(moral_counts, nonmoral_counts, token_list)
 
-    return results_dict
+    return stats_dict(table,
+                      moral_counts["_total_"],
+                      nonmoral_counts["_total_"])
+
+
+def lemma_keyness(
+    moral_list,
+    nonmoral_list,
+    language='de',
+    hanta=False,
+    attribute='lemma',
+    min_count=1,
+    export=None,
+    batch_size=None,
+    n_process=1
+):
+    """
+    Compares the complete vocabulary of moralizing and non-moralizing
+    segments, e.g. from list_moralization_strings_from_xmi() and
+    list_nonmorals_strings_from_xmi(), instead of a given term list.
+    Both lists are tagged only once (see tag_profile()).
+
+    Parameters:
+        moral_list, nonmoral_list: lists of strings
+        language, hanta: see count_instances_lemma()
+        attribute: 'lemma' or 'pos'
+        min_count: only terms occurring at least this often
+                   in both lists together are ranked
+        export: filename of an .xlsx file; if given, the ranking
+                is written there with dict_to_xlsx()
+        batch_size, n_process: passed on to spaCy's nlp.pipe
+    Returns:
+        DataFrame like get_stats_table() with one row per term, ranked
+        by Fisher p-value, then by the absolute log-ratio and the
+        absolute difference coefficient (both descending).
+    """
+    moral_profile = tag_profile(moral_list, language, hanta,
+                                batch_size, n_process, (attribute,))
+    nonmoral_profile = tag_profile(nonmoral_list, language, hanta,
+                                   batch_size, n_process, (attribute,))
+
+    moral_counter = moral_profile[attribute]
+    nonmoral_counter = nonmoral_profile[attribute]
+
+    # Dense count vectors over the union of both vocabularies, sorted
+    # so that tied terms are always ranked in the same order
+    terms = sorted(moral_counter.keys() | nonmoral_counter.keys())
+    moral_counts = np.fromiter((moral_counter[term] for term in terms),
+                               dtype=np.int64, count=len(terms))
+    nonmoral_counts = np.fromiter((nonmoral_counter[term] for term in terms),
+                                  dtype=np.int64, count=len(terms))
+
+    keep = (moral_counts + nonmoral_counts) >= min_count
+    table = get_stats_table(
+        [term for term, kept in zip(terms, keep) if kept],
+        moral_counts[keep],
+        moral_profile['_total_'],
+        nonmoral_counts[keep],
+        nonmoral_profile['_total_']
+    )
+
+    order = np.lexsort((
+        -table["diff_coeficient"].abs().fillna(0).to_numpy(),
+        -table["log_ratio"].abs().to_numpy(),
+        table["pvalue_fisher"].to_numpy()
+    ))
+    table = table.iloc[order]
+
+    if export:
+        dict_to_xlsx(table.to_dict('index'), export)
+
+    return table
 
 
 def dict_to_xlsx(dictionary, filename):
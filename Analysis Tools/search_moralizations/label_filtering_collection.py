@@ -2,6 +2,7 @@ import os
 import sys
 
 sys.path.append("../_utils_")
+import annotation_index as ai
 import label_filtering_single as lfs
 import xmi_analysis_util as xau
 
@@ -21,17 +22,41 @@ def lemma_label_instances_collection(
     lemma,
     label_type,
     hanta=False,
-    export=False
+    export=False,
+    use_index=False,
+    cache_dir=None
 ):
+    """
+    Runs lemma_label_instances() on every corpus of the collection.
+    If use_index is True, the queries are answered by the inverted
+    lemma index of each corpus instead, which is built on the first
+    query and then reused; cache_dir is passed on to its token store.
+    The index tags each corpus string as a whole, so its hits can
+    differ slightly from those of the moralization-wise tagging.
+    """
+    if not xau.valid_category(label_type):
+        return
+
     output_dict = {}
     for corpus in corpus_collection.collection.keys():
+        index = None
+        if use_index:
+            index = ai.annotation_index(
+                corpus_collection.collection[corpus],
+                label_type,
+                corpus_collection.language,
+                attribute='lemma',
+                hanta=hanta,
+                cache_dir=cache_dir
+            )
         output_dict[corpus] = lfs.lemma_label_instances(
             corpus_collection.collection[corpus],
             lemma,
             label_type,
             language=corpus_collection.language,
             hanta=hanta,
-            export=False
+            export=False,
+            index=index
         )
 
     if export:
@@ -46,18 +71,23 @@ def pos_label_instances_collection(
     pos,
     label_type,
     hanta=False,
-    export=False
+    export=False,
+    use_index=False,
+    cache_dir=None
 ):
-    output_dict = {}
-    for corpus in corpus_collection.collection.keys():
-        output_dict[corpus] = lfs.pos_label_instances(
-            corpus_collection.collection[corpus],
-            pos,
-            label_type,
-            language=corpus_collection.language,
-            hanta=hanta,
-            export=False
-        )
+    """
+    Runs pos_label_instances() on every corpus of the collection;
+    see poslist_label_instances_collection() for use_index.
+    """
+    output_dict = poslist_label_instances_collection(
+        corpus_collection,
+        [pos],
+        label_type,
+        hanta=hanta,
+        export=False,
+        use_index=use_index,
+        cache_dir=cache_dir
+    )
 
     if export:
         xau.dict_to_excel(output_dict,
@@ -71,17 +101,45 @@ def poslist_label_instances_collection(
     pos_list,
     label_type,
     hanta=False,
-    export=False
+    export=False,
+    use_index=False,
+    cache_dir=None,
+    match_all=False
 ):
+    """
+    Runs poslist_label_instances() on every corpus of the collection.
+    If use_index is True, the queries are answered by the POS posting
+    index of each corpus instead, which is built on the first query
+    and then reused; cache_dir is passed on to its token store.
+    The index tags each corpus string as a whole, so its hits can
+    differ slightly from those of the moralization-wise tagging.
+    If match_all is True, annotations must contain every POS tag
+    of pos_list instead of any of them.
+    """
+    if not xau.valid_category(label_type):
+        return
+
     output_dict = {}
     for corpus in corpus_collection.collection.keys():
+        index = None
+        if use_index:
+            index = ai.annotation_index(
+                corpus_collection.collection[corpus],
+                label_type,
+                corpus_collection.language,
+                attribute='pos',
+                hanta=hanta,
+                cache_dir=cache_dir
+            )
         output_dict[corpus] = lfs.poslist_label_instances(
             corpus_collection.collection[corpus],
             pos_list,
             label_type,
             language=corpus_collection.language,
             hanta=hanta,
-            export=False
+            export=False,
+            index=index,
+            match_all=match_all
         )
 
     if export:
@@ -133,3 +191,115 @@ def tag_label_instances_collection(
                           f"{tag}_{label_type}_instances.xlsx")
 
     return output_dict
+
+
+QUERY_TYPES = ('tag', 'count', 'lemma', 'pos')
+
+
+def batch_label_instances_collection(
+    corpus_collection,
+    queries,
+    hanta=False,
+    export=False,
+    use_index=False,
+    cache_dir=None
+):
+    """
+    Runs several searches over a collection in a single pass per corpus.
+    All queries on a corpus share its cached associations. If use_index
+    is True, lemma and POS queries also share its token store and
+    annotation indexes, so no corpus is tagged more than once.
+
+    Parameters:
+        corpus_collection: CorpusCollection object
+        queries: list of (query_type, value, label_type) tuples, where
+                 query_type is one of
+                 'tag'   -- value is an annotation label, see
+                            tag_label_instances_collection()
+                 'count' -- value is a number of annotations, see
+                            count_label_instances_collection()
+                 'lemma' -- value is a lemma, see
+                            lemma_label_instances_collection()
+                 'pos'   -- value is a POS tag or a list of POS tags, see
+                            poslist_label_instances_collection()
+        hanta: If True, lemma and POS queries use HanTa;
+               see ts.nlp_backend().
+        export: If True, every result is written to the Excel file
+                that the corresponding single query would write.
+        use_index, cache_dir: see lemma_label_instances_collection()
+    Returns:
+        List with one result per query, in the same order. Every result
+        is a dictionary like those of the *_collection functions, or
+        None if the query is invalid.
+    """
+    valid = []
+    for query_type, value, label_type in queries:
+        if query_type not in QUERY_TYPES:
+            print(f"Error: query type must be one of: {QUERY_TYPES}")
+            valid.append(False)
+        else:
+            valid.append(xau.valid_category(label_type))
+
+    results = [{} if is_valid else None for is_valid in valid]
+
+    def query_index(corpus, label_type, attribute):
+        if not use_index:
+            return None
+        return ai.annotation_index(
+            corpus, label_type, corpus_collection.language,
+            attribute=attribute, hanta=hanta, cache_dir=cache_dir)
+
+    for filepath, corpus in corpus_collection.collection.items():
+        for i, (query_type, value, label_type) in enumerate(queries):
+            if not valid[i]:
+                continue
+
+            if query_type == 'tag':
+                hits = lfs.tag_label_instances(corpus, value, label_type)
+            elif query_type == 'count':
+                hits = lfs.count_label_instances(corpus, value, label_type)
+            elif query_type == 'lemma':
+                hits = lfs.lemma_label_instances(
+                    corpus,
+                    value,
+                    label_type,
+                    language=corpus_collection.language,
+                    hanta=hanta,
+                    index=query_index(corpus, label_type, 'lemma')
+                )
+            else:
+                if isinstance(value, str):
+                    value = [value]
+                hits = lfs.poslist_label_instances(
+                    corpus,
+                    value,
+                    label_type,
+                    language=corpus_collection.language,
+                    hanta=hanta,
+                    index=query_index(corpus, label_type, 'pos')
+                )
+
+            results[i][filepath] = hits
+
+    if export:
+        for (query_type, value, label_type), result in zip(queries, results):
+            if result is not None:
+                xau.dict_to_excel(
+                    result,
+                    f"{query_name(query_type, value)}_{label_type}"
+                    "_instances.xlsx"
+                )
+
+    return results
+
+
+def query_name(query_type, value):
+    """
+    Returns the part of the export file name that the single
+    *_collection function of a query type uses for its value.
+    """
+    if query_type == 'count':
+        return str(value)
+    if query_type == 'pos' and not isinstance(value, str):
+        return f"[{value[1]}, ...]" if len(value) > 1 else str(value[0])
+    return str(value)
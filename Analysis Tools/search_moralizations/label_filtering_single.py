@@ -1,9 +1,7 @@
 import sys
-import nltk
-from HanTa import HanoverTagger as ht
-import spacy
 
 sys.path.append("../_utils_")
+import token_store as ts
 import xmi_analysis_util as xau
 
 
@@ -13,50 +11,28 @@ def lemma_label_instances(
     label_type,
     language="de",
     hanta=False,
-    export=False
+    export=False,
+    batch_size=None,
+    n_process=1,
+    store=None,
+    index=None
 ):
     if not xau.valid_category(label_type):
         return
 
-    label = getattr(corpus, label_type)
-
-    association = xau.label_associations(
-        corpus.moralizations,
-        label
-    )
-
-    relevant_spans_list = []
-
-    if (language == "de" or language == "en") and hanta:
-
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, instance), language=language)
-                tags = tagger.tag_sent(tokenized)
-                for tag in tags:
-                    if tag[1] == lemma:
-                        relevant_spans_list.append(moralization)
-                        break
-
+    if index is not None:
+        # Answered by the inverted lemma index, see annotation_index;
+        # a moralization is listed once per matching annotation
+        relevant_spans_list = [
+            corpus.moralizations[i]
+            for i in index.moralizations(index.annotations(lemma),
+                                         unique=False)
+        ]
     else:
-
-        model = spacy.load(f'{language}_core_news_md')
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                doc = model(xau.get_span(corpus.text, instance))
-                for token in doc:
-                    if token.lemma_ == lemma:
-                        relevant_spans_list.append(moralization)
-                        break
+        relevant_spans_list = lemma_moralizations(
+            corpus, lemma, label_type, language, hanta,
+            batch_size, n_process, store
+        )
 
     return_string_list = []
     for moralization in relevant_spans_list:
@@ -70,83 +46,80 @@ def lemma_label_instances(
     return return_string_list
 
 
-def poslist_label_instances(
+def lemma_moralizations(
     corpus,
-    pos_list,
+    lemma,
     label_type,
     language="de",
     hanta=False,
-    export=False
+    batch_size=None,
+    n_process=1,
+    store=None
 ):
+    """
+    Tags the moralizations of a corpus (or uses the tokens of store)
+    and returns the moralizations with an annotation of label_type
+    that contains the lemma, once for every such annotation.
+    """
+    association = corpus.associations(label_type, coordinates_only=True)
 
-    if not xau.valid_category(label_type):
-        return
-
-    label = getattr(corpus, label_type)
-
-    association = xau.label_associations_category(
-        corpus.moralizations,
-        label
-    )
-
-    relevant_spans_dict = {}
+    relevant_spans_list = []
 
-    if (language == "de" or language == "en") and hanta:
+    for moralization, instance, span_store in ts.moralization_instances(
+            corpus, association, language, hanta, batch_size, n_process,
+            store, attributes=('lemma',)):
+        if lemma in span_store.lemmas(instance):
+            relevant_spans_list.append(moralization)
 
-        if language == "de":
-            tagger = ht.HanoverTagger('morphmodel_ger.pgz')
-            language = 'german'
-        elif language == "en":
-            tagger = ht.HanoverTagger('morphmodel_en.pgz')
-            language = 'english'
+    return relevant_spans_list
 
-        relevant_spans_list = []
 
-        for moralization, instances in association.items():
-            for instance in instances:
-                tokenized = nltk.tokenize.word_tokenize(
-                    xau.get_span(corpus.text, moralization), language=language)
-                tags = tagger.tag_sent(tokenized)
+def poslist_label_instances(
+    corpus,
+    pos_list,
+    label_type,
+    language="de",
+    hanta=False,
+    export=False,
+    batch_size=None,
+    n_process=1,
+    store=None,
+    index=None,
+    match_all=False
+):
 
-                for tag in tags:
-                    if tag[2] in pos_list and tag[0].lower() in xau.get_span(
-                                corpus.text, instance["Coordinates"]
-                                ).lower():
-                        relevant_spans_list.append(instance)
-                        break
+    if not xau.valid_category(label_type):
+        return
 
+    if index is not None:
+        # Answered by the POS posting index, see annotation_index
+        if match_all:
+            annotation_ids = index.annotations_all(pos_list)
+        else:
+            annotation_ids = index.annotations_any(pos_list)
+        labels = getattr(corpus, label_type)
+        relevant_spans_list = [
+            labels[i] for i in annotation_ids
+            if index.moralization_ids[i] >= 0
+        ]
     else:
+        relevant_spans_list = pos_annotations(
+            corpus, pos_list, label_type, language, hanta,
+            batch_size, n_process, store, match_all
+        )
 
-        model = spacy.load(f'{language}_core_news_md')
-
-        for moralization, instances in association.items():
-            for instance in instances:
-                doc = model(xau.get_span(corpus.text, moralization))
-
-                for tag in doc:
-                    if tag.pos_ in pos_list and tag.text in xau.get_span(
-                                corpus.text,
-                                instance["Coordinates"]):
-                        relevant_spans_list.append(instance)
-                        break
-
-    relevant_spans_dict = xau.label_associations(corpus.moralizations,
-                                                 relevant_spans_list)
+    relevant_spans_dict = xau.label_associations(
+        corpus.moralizations,
+        relevant_spans_list,
+        index=corpus.moralization_index
+    )
 
-    text = corpus.text
     return_string_list = []
 
     for moralization, relevant_instances in relevant_spans_dict.items():
         if relevant_instances != []:
-            for instance in relevant_instances:
-                if xau.get_span(text, instance):
-                    text = (
-                        text[:(instance[0])]
-                        + xau.special_upper(xau.get_span(text, instance))
-                        + text[(instance[1]):]
-                    )
-            output_string = xau.get_span(text, moralization)
-            return_string_list.append(output_string)
+            return_string_list.append(xau.highlight_span(
+                corpus.text, moralization, relevant_instances))
 
     if export:
         xau.list_to_excel(return_string_list,
@@ -155,13 +128,51 @@ def poslist_label_instances(
     return return_string_list
 
 
+def pos_annotations(
+    corpus,
+    pos_list,
+    label_type,
+    language="de",
+    hanta=False,
+    batch_size=None,
+    n_process=1,
+    store=None,
+    match_all=False
+):
+    """
+    Tags the moralizations of a corpus (or uses the tokens of store)
+    and returns the annotations of label_type that contain a token
+    with any POS tag of pos_list (or with every tag, if match_all).
+    """
+    association = corpus.associations(label_type)
+
+    relevant_spans_list = []
+
+    for moralization, instance, span_store in ts.moralization_instances(
+            corpus, association, language, hanta, batch_size, n_process,
+            store, attributes=('pos',)):
+        tags = span_store.pos(instance["Coordinates"])
+        if match_all:
+            hit = all(pos in tags for pos in pos_list)
+        else:
+            hit = any(pos in pos_list for pos in tags)
+        if hit:
+            relevant_spans_list.append(instance)
+
+    return relevant_spans_list
+
+
 def pos_label_instances(
     corpus,
     pos,
     label_type,
     language="ger",
     hanta=False,
-    export=False
+    export=False,
+    batch_size=None,
+    n_process=1,
+    store=None,
+    index=None
 ):
 
     hits_list = poslist_label_instances(
@@ -170,7 +181,11 @@ def pos_label_instances(
         label_type,
         language,
         hanta,
-        export=False
+        export=False,
+        batch_size=batch_size,
+        n_process=n_process,
+        store=store,
+        index=index
     )
 
     if export:
@@ -190,12 +205,7 @@ def count_label_instances(
     if not xau.valid_category(label_type):
         return
 
-    label = getattr(corpus, label_type)
-
-    association = xau.label_associations(
-        corpus.moralizations,
-        label
-    )
+    association = corpus.associations(label_type, coordinates_only=True)
 
     relevant_spans_dict = {
         key: entry for key, entry
@@ -203,18 +213,13 @@ def count_label_instances(
         if len(entry) == count
     }
 
-    text = corpus.text
     return_string_list = []
     for moralization_tuple in relevant_spans_dict:
-        for protagonist in relevant_spans_dict[moralization_tuple]:
-            if xau.get_span(corpus.text, protagonist):
-                text = (
-                    text[:(protagonist[0])]
-                    + xau.special_upper(xau.get_span(corpus.text, protagonist))
-                    + text[(protagonist[1]):]
-                )
-        output_string = xau.get_span(text, moralization_tuple)
-        return_string_list.append(output_string)
+        return_string_list.append(xau.highlight_span(
+            corpus.text,
+            moralization_tuple,
+            relevant_spans_dict[moralization_tuple]
+        ))
 
     if export:
         xau.list_to_excel(return_string_list,
@@ -233,8 +238,6 @@ def tag_label_instances(
     if not xau.valid_category(label_type):
         return
 
-    text = corpus.text
-
     labels = getattr(corpus, label_type)
 
     matched_anno_list = []
@@ -242,21 +245,17 @@ def tag_label_instances(
         if label in span.values():
             matched_anno_list.append(span)
 
-    relevant_spans_dict = xau.label_associations(corpus.moralizations,
-                                                 matched_anno_list)
+    relevant_spans_dict = xau.label_associations(
+        corpus.moralizations,
+        matched_anno_list,
+        index=corpus.moralization_index
+    )
 
     return_string_list = []
     for moralization, relevant_instances in relevant_spans_dict.items():
         if relevant_instances != []:
-            for instance in relevant_instances:
-                if xau.get_span(text, instance):
-                    text = "".join((
-                        text[:(instance[0])],
-                        xau.special_upper(xau.get_span(text, instance)),
-                        text[(instance[1]):]
-                    ))
-            output_string = xau.get_span(text, moralization)
-            return_string_list.append(output_string)
+            return_string_list.append(xau.highlight_span(
+                corpus.text, moralization, relevant_instances))
 
     if export:
         xau.list_to_excel(return_string_list,
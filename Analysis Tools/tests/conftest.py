@@ -0,0 +1,53 @@
+import os
+import re
+import sys
+from importlib import metadata
+
+import pytest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTFILES_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'Testfiles')
+
+# The analysis modules import each other from these directories
+for directory in ('_utils_', 'search_moralizations', 'moral_indicators',
+                  'annotation_statistics'):
+    sys.path.insert(0, os.path.join(TOOLS_DIR, directory))
+
+import corpus_extraction as ce  # noqa: E402
+import token_store as ts  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def corpus_de():
+    return ce.CorpusData(
+        os.path.join(TESTFILES_DIR, 'test_gerichtsurteile_DE.xmi'))
+
+
+@pytest.fixture(scope='session')
+def collection_de():
+    return ce.CorpusCollection(
+        [os.path.join(TESTFILES_DIR, 'test_gerichtsurteile_DE.xmi')],
+        language='de'
+    )
+
+
+def regex_store(text):
+    """
+    TokenStore with word and punctuation tokens, the lower-cased token
+    as lemma and 'NN' or 'X' as POS tag; needs no NLP model.
+    """
+    tokens = [
+        (match.start(), match.end(), match.group().lower(),
+         'NN' if match.group().istitle() else 'X')
+        for match in re.finditer(r'\w+|[^\w\s]', text)
+    ]
+    return ts.build_store(text, tokens, 'regex')
+
+
+def has_spacy_model(language):
+    """Returns True if the spaCy pipeline for language is installed."""
+    try:
+        metadata.version(f'{language}_core_news_md')
+    except metadata.PackageNotFoundError:
+        return False
+    return True
@@ -0,0 +1,31 @@
+import os
+import shutil
+
+import pandas as pd
+
+import comparison_list_gen as clg
+import dimi_matcher as dm
+
+
+def dimi_sheet(filepath, sheet):
+    cells = pd.read_excel(filepath, sheet_name=sheet, header=None)[0]
+    return list(dict.fromkeys(
+        cell.strip() for cell in cells
+        if isinstance(cell, str) and cell.strip()))
+
+
+def test_dimi_sheet_from_lexicon(tmp_path):
+    filename = dm.DIMI_FILES[('de', 'final')]
+    workbook = str(tmp_path / filename)
+    shutil.copy(os.path.join(dm.DIMI_DIRECTORY, filename), workbook)
+    # Written after the copied workbook, so it is the one that is used
+    dm.build_dimi_lexicon(filepath=str(tmp_path / dm.LEXICON_FILE))
+
+    expected = dimi_sheet(workbook, 'negative selection')
+    os.remove(workbook)
+
+    assert clg.get_comparison_list(
+        workbook, 0, 'negative selection') == expected
+    assert clg.get_comparison_list(
+        workbook, 0, 'negative selection', expected[:1],
+        top_hits=5) == expected[1:5]
@@ -0,0 +1,67 @@
+import os
+import zlib
+
+import corpus_extraction as ce
+from conftest import TESTFILES_DIR
+
+
+def load_corpus():
+    return ce.CorpusData(
+        os.path.join(TESTFILES_DIR, 'test_gerichtsurteile_DE.xmi'))
+
+
+def test_reassigned_layer_is_rebuilt():
+    corpus = load_corpus()
+    before = corpus.label_counts('protagonists', 'Rolle', ['Forderer:in'])
+
+    corpus.protagonists = corpus.protagonists[:-1]
+
+    assert corpus.label_counts(
+        'protagonists', 'Rolle', ['Forderer:in']) is not before
+
+
+def test_invalidate_after_in_place_edit():
+    corpus = load_corpus()
+    moralization, instances = next(
+        (moralization, instances) for moralization, instances
+        in corpus.associations('protagonists').items() if instances)
+    first = corpus.protagonists.index(instances[0])
+
+    # Same length, same list object: only invalidate() notices this
+    corpus.protagonists[first] = dict(
+        instances[0], Coordinates=(moralization[0], moralization[0]))
+    corpus.invalidate('protagonists')
+
+    assert corpus.associations('protagonists')[moralization][0] \
+        == corpus.protagonists[first]
+
+
+def test_invalidate_keeps_other_layers():
+    corpus = load_corpus()
+    morals = corpus.associations('all_morals')
+
+    corpus.invalidate('protagonists')
+
+    assert corpus.associations('all_morals') is morals
+    corpus.invalidate()
+    assert corpus.associations('all_morals') is not morals
+
+
+def test_layers_cache_round_trip(tmp_path):
+    filepath = os.path.join(TESTFILES_DIR, 'test_gerichtsurteile_DE.xmi')
+
+    first = ce.load_layers(filepath, cache_dir=str(tmp_path))
+    cached = ce.load_layers(filepath, cache_dir=str(tmp_path))
+
+    assert len(os.listdir(tmp_path)) == 1
+    assert cached == first == ce.layers_from_xmi(filepath)
+
+
+def test_unreadable_layers_cache_is_ignored(tmp_path):
+    cache_path = str(tmp_path / 'layers.json.z')
+
+    for content in (b'', b'not compressed', zlib.compress(b'[1, 2]'),
+                    zlib.compress(b'{"version": 1, "layers": {}}')):
+        with open(cache_path, 'wb') as f:
+            f.write(content)
+        assert ce.read_layers_cache(cache_path) is None
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+import moral_vs_nonmoral as mvn
+import xmi_analysis_util as xau
+
+
+def scipy_pvalues(tables):
+    return np.array([stats.fisher_exact(table)[1] for table in tables])
+
+
+@pytest.mark.parametrize('high', [6, 60, 6000])
+def test_matches_scipy(high):
+    tables = np.random.default_rng(high).integers(
+        0, high, size=(200, 2, 2))
+
+    np.testing.assert_allclose(xau.fisher_exact_batch(tables),
+                               scipy_pvalues(tables), rtol=1e-6)
+
+
+def test_single_possible_table():
+    assert mvn.get_stats(0, 10, 0, 10)['pvalue_fisher'] == 1.0
+
+    tables = [[[0, 10], [0, 10]], [[0, 0], [0, 0]],
+              [[5, 0], [0, 0]], [[0, 0], [7, 3]]]
+    assert xau.fisher_exact_batch(tables).tolist() == [1.0] * 4
+
+
+def test_at_most_one():
+    tables = np.random.default_rng(0).integers(0, 4, size=(500, 2, 2))
+
+    assert xau.fisher_exact_batch(tables).max() <= 1.0
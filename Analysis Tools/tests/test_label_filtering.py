@@ -0,0 +1,106 @@
+import pytest
+
+import annotation_index as ai
+import label_filtering_collection as lfc
+import label_filtering_single as lfs
+import token_store as ts
+from conftest import has_spacy_model, regex_store
+
+LABEL_TYPES = ['protagonists', 'all_morals', 'com_functions']
+
+
+@pytest.mark.parametrize('label_type', LABEL_TYPES)
+@pytest.mark.parametrize('lemma', ['der', 'die', 'und', 'gericht'])
+def test_lemma_index_matches_store(corpus_de, label_type, lemma):
+    store = regex_store(corpus_de.text)
+    index = ai.annotation_index(corpus_de, label_type, 'de', store=store)
+
+    by_store = lfs.lemma_label_instances(
+        corpus_de, lemma, label_type, 'de', store=store)
+    by_index = lfs.lemma_label_instances(
+        corpus_de, lemma, label_type, 'de', index=index)
+
+    assert by_store == by_index
+
+
+def test_lemma_hits_per_annotation(corpus_de):
+    store = regex_store(corpus_de.text)
+    association = corpus_de.associations('protagonists',
+                                         coordinates_only=True)
+    expected = sum(
+        'der' in store.lemmas(instance)
+        for instances in association.values() for instance in instances
+    )
+
+    hits = lfs.lemma_label_instances(
+        corpus_de, 'der', 'protagonists', 'de', store=store)
+
+    assert len(hits) == expected
+
+
+@pytest.mark.parametrize('label_type', LABEL_TYPES)
+@pytest.mark.parametrize('pos_list', [['NN'], ['X'], ['NN', 'X']])
+@pytest.mark.parametrize('match_all', [False, True])
+def test_pos_index_matches_store(corpus_de, label_type, pos_list, match_all):
+    store = regex_store(corpus_de.text)
+    index = ai.annotation_index(corpus_de, label_type, 'de',
+                                attribute='pos', store=store)
+
+    by_store = lfs.poslist_label_instances(
+        corpus_de, pos_list, label_type, 'de',
+        store=store, match_all=match_all)
+    by_index = lfs.poslist_label_instances(
+        corpus_de, pos_list, label_type, 'de',
+        index=index, match_all=match_all)
+
+    assert by_store == by_index
+
+
+@pytest.mark.skipif(not has_spacy_model('de'),
+                    reason='de_core_news_md is not installed')
+@pytest.mark.parametrize('use_index', [False, True])
+def test_collection_matches_single(collection_de, use_index):
+    [(filepath, corpus)] = collection_de.collection.items()
+    store = ts.token_store(corpus, 'de') if use_index else None
+
+    lemma_hits = lfc.lemma_label_instances_collection(
+        collection_de, 'Gericht', 'protagonists', use_index=use_index)
+    pos_hits = lfc.poslist_label_instances_collection(
+        collection_de, ['NOUN', 'PROPN'], 'protagonists',
+        use_index=use_index)
+
+    assert lemma_hits[filepath] == lfs.lemma_label_instances(
+        corpus, 'Gericht', 'protagonists', 'de', store=store)
+    assert pos_hits[filepath] == lfs.poslist_label_instances(
+        corpus, ['NOUN', 'PROPN'], 'protagonists', 'de', store=store)
+
+
+def test_batch_matches_collection_without_nlp(collection_de):
+    queries = [('count', 1, 'protagonists'),
+               ('tag', 'Forderer:in', 'protagonists_doubles'),
+               ('lemma', 'der', 'no_layer')]
+
+    results = lfc.batch_label_instances_collection(collection_de, queries)
+
+    assert results[0] == lfc.count_label_instances_collection(
+        collection_de, 1, 'protagonists')
+    assert results[1] == lfc.tag_label_instances_collection(
+        collection_de, 'Forderer:in', 'protagonists_doubles')
+    assert results[2] is None
+
+
+@pytest.mark.skipif(not has_spacy_model('de'),
+                    reason='de_core_news_md is not installed')
+@pytest.mark.parametrize('use_index', [False, True])
+def test_batch_matches_collection(collection_de, use_index):
+    queries = [('lemma', 'Gericht', 'protagonists'),
+               ('pos', ['NOUN', 'PROPN'], 'protagonists')]
+
+    results = lfc.batch_label_instances_collection(
+        collection_de, queries, use_index=use_index)
+
+    assert results[0] == lfc.lemma_label_instances_collection(
+        collection_de, 'Gericht', 'protagonists', use_index=use_index)
+    assert results[1] == lfc.poslist_label_instances_collection(
+        collection_de, ['NOUN', 'PROPN'], 'protagonists',
+        use_index=use_index)
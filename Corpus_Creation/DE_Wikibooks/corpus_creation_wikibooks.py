@@ -9,7 +9,7 @@ def print_moral_sentences(corpus_file_name):
 
     with open(r"Morallexika\neg-selection-of-selection.txt",
               "r", encoding="utf-8") as f:
-        morallexikon = f.read().split()
+        morallexikon = set(f.read().split())
 
     with open(corpus_file_name, 'r', encoding='utf-8') as f:
         file_contents = json.load(f)